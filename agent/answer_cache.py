@@ -0,0 +1,74 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from agent.config import ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SEC
+from agent.vector_store import cosine_scores
+
+
+def normalise_query(query):
+    return " ".join(re.sub(r"[^a-z0-9\-\s]", " ", query.lower()).split())
+
+
+# Answers keyed by normalised question. An exact match costs nothing; otherwise the
+# question embedding is compared with cached ones. Entries computed against a
+# different cost-data fingerprint are dropped on sight.
+class SemanticCache:
+
+    def __init__(self, embed_fn, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL_SEC):
+        self.embed_fn    = embed_fn
+        self.threshold   = threshold
+        self.max_entries = max_entries
+        self.ttl         = ttl
+        self._entries    = OrderedDict()
+        self._lock       = threading.Lock()
+        self._stats      = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidated": 0}
+
+    def _evict_stale(self, fingerprint, now):
+        # Caller holds self._lock
+        for key in [k for k, e in self._entries.items() if e["fingerprint"] != fingerprint or e["expires_at"] <= now]:
+            del self._entries[key]
+            self._stats["invalidated"] += 1
+
+    # vector, when the caller already has the question's embedding, saves a model call
+    async def lookup(self, query, fingerprint, vector=None):
+        key = normalise_query(query)
+        with self._lock:
+            self._evict_stale(fingerprint, time.time())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return entry["result"], entry["vector"]
+            candidates = list(self._entries.items())
+        # The raw question is embedded, as retrieval and routing do, so the vector
+        # returned here can be reused by both
+        if vector is None:
+            vector = (await self.embed_fn.acall([query]))[0]
+        best_key, best_sim = None, 0.0
+        sims = cosine_scores(vector, [entry["vector"] for _, entry in candidates])
+        if len(sims) and sims.max() > 0:
+            best = int(sims.argmax())
+            best_key, best_sim = candidates[best][0], float(sims[best])
+        with self._lock:
+            if best_key is not None and best_sim >= self.threshold and best_key in self._entries:
+                self._entries.move_to_end(best_key)
+                self._stats["semantic_hits"] += 1
+                return dict(self._entries[best_key]["result"], cache_similarity=round(best_sim, 4)), vector
+            self._stats["misses"] += 1
+        return None, vector
+
+    def store(self, query, vector, fingerprint, result):
+        key = normalise_query(query)
+        with self._lock:
+            self._entries[key] = {"vector": vector, "fingerprint": fingerprint, "result": result, "expires_at": time.time() + self.ttl}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["exact_hits"] + stats["semantic_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
@@ -1,9 +1,35 @@
 import os
+from pathlib import Path
 
 # Set DEMO_MODE=true to run without any credentials
 # Perfect for committee review and demonstrations
 DEMO_MODE = os.environ.get("DEMO_MODE", "true").lower() == "true"
 AWS_REGION = os.environ.get("AWS_DEFAULT_REGION", "us-east-1")
+BEDROCK_MAX_CONCURRENCY = int(os.environ.get("BEDROCK_MAX_CONCURRENCY", "16"))
+REFLECTION_ACCEPT_SCORE = float(os.environ.get("REFLECTION_ACCEPT_SCORE", "7.5"))
+REFLECTION_RETRY_SCORE = float(os.environ.get("REFLECTION_RETRY_SCORE", "4"))
+ROUTER_CONFIDENCE = float(os.environ.get("ROUTER_CONFIDENCE", "0.75"))
+ROUTER_NEAREST_NEIGHBOUR = os.environ.get("ROUTER_NEAREST_NEIGHBOUR", "true").lower() == "true"
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL_SEC = int(os.environ.get("ANSWER_CACHE_TTL_SEC", "3600"))
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "3000"))
+PROMPT_MAX_ROWS = int(os.environ.get("PROMPT_MAX_ROWS", "31"))
+PLANNER_KB_TOKEN_BUDGET = int(os.environ.get("PLANNER_KB_TOKEN_BUDGET", "400"))
+PLANNER_KB_WAIT_MS = int(os.environ.get("PLANNER_KB_WAIT_MS", "250"))
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", "8"))
+EMBED_MAX_IN_FLIGHT = int(os.environ.get("EMBED_MAX_IN_FLIGHT", "16"))
+EMBED_CACHE_ENABLED = os.environ.get("EMBED_CACHE_ENABLED", "true").lower() == "true"
+EMBED_CACHE_PATH = os.environ.get("EMBED_CACHE_PATH", str(Path(__file__).parent.parent / "data" / "embedding_cache.db"))
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma").lower()
+VECTOR_ANN = os.environ.get("VECTOR_ANN", "exact").lower()
+RETRIEVAL_HYBRID = os.environ.get("RETRIEVAL_HYBRID", "true").lower() == "true"
+RETRIEVAL_CANDIDATES = int(os.environ.get("RETRIEVAL_CANDIDATES", "12"))
+RETRIEVAL_MIN_SCORE = float(os.environ.get("RETRIEVAL_MIN_SCORE", "0.4"))
+RRF_K = int(os.environ.get("RRF_K", "60"))
+KB_WATCH_INTERVAL_SEC = float(os.environ.get("KB_WATCH_INTERVAL_SEC", "2"))
+SPECULATIVE_EXECUTION = os.environ.get("SPECULATIVE_EXECUTION", "true").lower() == "true"
 
 if DEMO_MODE:
     print("=" * 50)
@@ -0,0 +1,76 @@
+import os
+import array
+import sqlite3
+import hashlib
+import threading
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Content-addressed embedding store: one row per (model id, sha256 of text) holding
+# the vector as a float32 blob, so unchanged chunks and repeat questions never go
+# back to the embedding model.
+class EmbeddingCache:
+
+    def __init__(self, path, model_id):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.model_id = model_id
+        self._lock    = threading.Lock()
+        self._conn    = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, digest TEXT, dim INTEGER, vector BLOB, PRIMARY KEY (model, digest))"
+        )
+        self._conn.commit()
+        self._stats   = {"hits": 0, "misses": 0, "stored": 0}
+
+    @staticmethod
+    def _pack(vector):
+        return array.array("f", vector).tobytes()
+
+    @staticmethod
+    def _unpack(blob):
+        vec = array.array("f")
+        vec.frombytes(blob)
+        return vec.tolist()
+
+    def get_many(self, digests):
+        found = {}
+        unique = list(dict.fromkeys(digests))
+        with self._lock:
+            # SQLite caps bound parameters; 500 stays well inside every build's limit
+            for s in range(0, len(unique), 500):
+                part = unique[s:s+500]
+                rows = self._conn.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({','.join('?' * len(part))})",
+                    [self.model_id, *part],
+                ).fetchall()
+                found.update((d, self._unpack(blob)) for d, blob in rows)
+            hits = sum(1 for d in digests if d in found)
+            self._stats["hits"]   += hits
+            self._stats["misses"] += len(digests) - hits
+        return found
+
+    def put_many(self, items):
+        rows = [(self.model_id, d, len(v), self._pack(v)) for d, v in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+            self._stats["stored"] += len(rows)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings WHERE model = ?", (self.model_id,))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model_id,)).fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
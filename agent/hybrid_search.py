@@ -0,0 +1,99 @@
+import re
+import math
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9\-]*")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how",
+    "i", "in", "is", "it", "my", "of", "on", "or", "our", "should", "that", "the", "this", "to",
+    "was", "we", "were", "what", "when", "where", "which", "why", "will", "with", "you", "your",
+}
+
+
+def _stem(tok):
+    if len(tok) > 4 and tok.endswith("ies"):
+        return tok[:-3] + "y"
+    if len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+        return tok[:-1]
+    return tok
+
+
+# "rg-production" is kept whole for exact matches and also split into its parts
+def tokenize(text):
+    tokens = []
+    for tok in TOKEN_PATTERN.findall(text.lower()):
+        if tok in STOPWORDS:
+            continue
+        tokens.append(_stem(tok))
+        if "-" in tok:
+            tokens.extend(_stem(p) for p in tok.split("-") if p and p not in STOPWORDS)
+    return tokens
+
+
+# Okapi BM25 over an inverted index of term -> {doc id: term frequency}
+class BM25Index:
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1       = k1
+        self.b        = b
+        self.postings = {}
+        self.lengths  = {}
+        self.docs     = {}
+
+    @classmethod
+    def build(cls, ids, texts, metadatas):
+        index = cls()
+        for cid, text, meta in zip(ids, texts, metadatas):
+            index.add(cid, text, meta)
+        return index
+
+    def add(self, cid, text, meta):
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[cid] = tf
+        self.lengths[cid] = sum(terms.values())
+        self.docs[cid]    = (text, meta)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.docs) - df + 0.5) / (df + 0.5))
+
+    def search(self, query, top_k):
+        n = len(self.docs)
+        if not n:
+            return []
+        avg_len = sum(self.lengths.values()) / n
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf(term)
+            for cid, tf in posting.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[cid] / avg_len)
+                scores[cid] = scores.get(cid, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:top_k]
+
+
+def rrf_fuse(rankings, k=60):
+    fused = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, start=1):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+# Cheap local re-ranker: fused rank (normalised to the best possible RRF score),
+# IDF-weighted share of query terms present in the chunk, an exact-phrase bonus and
+# the cosine similarity when the chunk came back from the vector search.
+def rerank_score(term_weights, phrase, text, fused, max_fused, similarity):
+    lowered  = text.lower()
+    tokens   = set(tokenize(text))
+    total    = sum(term_weights.values())
+    coverage = sum(w for t, w in term_weights.items() if t in tokens) / total if total else 0.0
+    bonus    = 1.0 if phrase and phrase in lowered else 0.0
+    score = 0.4 * fused / max_fused + 0.35 * coverage + 0.1 * bonus + 0.15 * max(similarity, 0.0)
+    return round(score, 4)
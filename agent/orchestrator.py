@@ -1,33 +1,82 @@
 import os
+import re
 import json
+import time
+import asyncio
+import threading
 import boto3
-from agent.config import DEMO_MODE, AWS_REGION
+from concurrent.futures import ThreadPoolExecutor
+from agent.config import DEMO_MODE, AWS_REGION, BEDROCK_MAX_CONCURRENCY, SPECULATIVE_EXECUTION, ANSWER_CACHE_ENABLED, PLANNER_KB_TOKEN_BUDGET, PLANNER_KB_WAIT_MS
+from agent.answer_cache import SemanticCache
+from agent.prompt_builder import assemble, estimate_tokens, fit_kb
 from agent.rag_retriever import RAGRetriever
+from agent.reflection import ReflectionEngine
+from agent.router import ToolRouter
 from agent.secrets_manager import get_azure_credentials
 from agent.secure_logger import get_logger
 from tools.azure_cost import (
     get_cost_by_service,
     get_daily_cost_trend,
     get_cost_by_resource_group,
+    get_resource_group_anomalies,
     suggest_optimisations,
+    cost_data_fingerprint,
 )
 
 get_azure_credentials()
 logger = get_logger("azure-cost-agent")
+MODEL_ID     = "anthropic.claude-3-haiku-20240307-v1:0"
+BEDROCK_POOL = ThreadPoolExecutor(max_workers=BEDROCK_MAX_CONCURRENCY, thread_name_prefix="bedrock")
 
 TOOL_MAP = {
-    "get_cost_by_service":        get_cost_by_service,
-    "get_daily_cost_trend":       get_daily_cost_trend,
-    "get_cost_by_resource_group": get_cost_by_resource_group,
-    "suggest_optimisations":      suggest_optimisations,
+    "get_cost_by_service":          get_cost_by_service,
+    "get_daily_cost_trend":         get_daily_cost_trend,
+    "get_cost_by_resource_group":   get_cost_by_resource_group,
+    "get_resource_group_anomalies": get_resource_group_anomalies,
+    "suggest_optimisations":        suggest_optimisations,
 }
 
+# Tools that consume another tool's output: name -> (dependency, keyword argument)
+TOOL_DEPENDENCIES = {
+    "suggest_optimisations": ("get_cost_by_service", "cost_data"),
+}
+
+# Keyword rules used by the demo planner: first match wins.
+KEYWORD_ROUTES = [
+    (["spike", "anomaly", "trend", "daily"], "get_daily_cost_trend", "trend query"),
+    (["resource group"],                     "get_cost_by_resource_group", "resource group query"),
+    (["reduc", "optim", "sav", "cheaper"],   "suggest_optimisations", "optimisation query"),
+]
+
+
+def route_by_keywords(text):
+    t = text.lower()
+    for words, tool, reason in KEYWORD_ROUTES:
+        if any(w in t for w in words):
+            return tool, reason
+    return "get_cost_by_service", "default breakdown"
+
+
+class _Prefetch:
+
+    def __init__(self, tasks=None):
+        self.tasks = tasks or {}
+        self.used  = set()
+
+    def take(self, name):
+        if name in self.tasks:
+            self.used.add(name)
+            return self.tasks[name]
+        return None
+
+
 TOOL_DESCRIPTIONS = """
 Available tools pick the ONE that best answers the user question:
 1. get_cost_by_service() - Use when user asks which service costs most or total spend.
 2. get_daily_cost_trend() - Use when user asks about spikes anomalies or trends.
 3. get_cost_by_resource_group() - Use when user asks about cost per team or environment.
 4. suggest_optimisations(cost_data) - Use when user asks how to reduce cost or save money.
+5. get_resource_group_anomalies() - Use when user asks which resource group or team had a spike.
 """
 
 
@@ -49,18 +98,18 @@ class AzureCostAgent:
             self.bedrock = None
             print("Demo mode active - using mock responses")
         self.rag = RAGRetriever()
+        self.speculation_stats = {"prefetched": 0, "used": 0, "discarded": 0}
+        self.token_stats = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+        self._usage_lock = threading.Lock()
+        self.reflection = ReflectionEngine(judge=self._llm_reflect)
+        self.router = ToolRouter(embed_fn=self.rag._embed_fn)
+        self.answer_cache = SemanticCache(self.rag._embed_fn) if ANSWER_CACHE_ENABLED else None
 
     def _mock_response(self, prompt):
         p = prompt.lower()
         if "primary_tool" in p:
-            if any(w in p for w in ["spike", "anomaly", "trend", "daily"]):
-                return json.dumps({"primary_tool": "get_daily_cost_trend", "secondary_tool": None, "reasoning": "trend query"})
-            elif "resource group" in p:
-                return json.dumps({"primary_tool": "get_cost_by_resource_group", "secondary_tool": None, "reasoning": "resource group query"})
-            elif any(w in p for w in ["reduc", "optim", "sav", "cheaper"]):
-                return json.dumps({"primary_tool": "suggest_optimisations", "secondary_tool": None, "reasoning": "optimisation query"})
-            else:
-                return json.dumps({"primary_tool": "get_cost_by_service", "secondary_tool": None, "reasoning": "default breakdown"})
+            tool, reason = route_by_keywords(p)
+            return json.dumps({"primary_tool": tool, "secondary_tool": None, "reasoning": reason})
         elif any(w in p for w in ["score", "rate this", "evaluate"]):
             return json.dumps({"score": 8, "reason": "Good demo answer", "should_retry": False})
         elif any(w in p for w in ["spike", "anomaly", "unusual", "yesterday", "happened"]):
@@ -147,34 +196,169 @@ class AzureCostAgent:
     def _call_claude(self, prompt):
         if self.use_mock:
             return self._mock_response(prompt)
-        body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 1024,
-            "messages": [{"role": "user", "content": prompt}],
-        }
         response = self.bedrock.invoke_model(
-            modelId="anthropic.claude-3-haiku-20240307-v1:0",
-            body=json.dumps(body),
+            modelId=MODEL_ID,
+            body=self._request_body(prompt),
             contentType="application/json",
             accept="application/json",
         )
         result = json.loads(response["body"].read())
+        self._record_usage(prompt, result.get("usage", {}))
         return result["content"][0]["text"]
 
-    def run(self, query):
+    def _record_usage(self, prompt, usage):
+        estimated = estimate_tokens(prompt)
+        with self._usage_lock:
+            self.token_stats["calls"] += 1
+            self.token_stats["input_tokens"] += usage.get("input_tokens", estimated)
+            self.token_stats["output_tokens"] += usage.get("output_tokens", 0)
+        logger.info(f"Bedrock call: input_tokens={usage.get('input_tokens', '?')} (estimated {estimated}) output_tokens={usage.get('output_tokens', '?')}")
+
+    def _request_body(self, prompt):
+        return json.dumps({
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 1024,
+            "messages": [{"role": "user", "content": prompt}],
+        })
+
+    def _stream_claude(self, prompt):
+        if self.use_mock:
+            yield from re.findall(r"\S+\s*", self._mock_response(prompt))
+            return
+        response = self.bedrock.invoke_model_with_response_stream(
+            modelId=MODEL_ID,
+            body=self._request_body(prompt),
+            contentType="application/json",
+            accept="application/json",
+        )
+        usage = {}
+        for event in response["body"]:
+            chunk = json.loads(event["chunk"]["bytes"])
+            if chunk.get("type") == "message_start":
+                usage.update(chunk["message"].get("usage", {}))
+            elif chunk.get("type") == "message_delta":
+                usage.update(chunk.get("usage", {}))
+            elif chunk.get("type") == "content_block_delta" and chunk["delta"].get("type") == "text_delta":
+                yield chunk["delta"]["text"]
+        self._record_usage(prompt, usage)
+
+    # Drains the blocking Bedrock event stream on the Bedrock pool and hands each
+    # delta to the event loop, so on_token always runs on the caller's thread.
+    async def _astream_claude(self, prompt):
+        loop  = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done  = object()
+
+        def pump():
+            try:
+                for text in self._stream_claude(prompt):
+                    loop.call_soon_threadsafe(queue.put_nowait, text)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        worker = loop.run_in_executor(BEDROCK_POOL, pump)
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        await worker
+
+    # boto3 has no asyncio transport; the blocking call runs on a bounded pool so many
+    # queries can share one event loop without opening unlimited Bedrock connections.
+    async def _acall_claude(self, prompt):
+        if self.use_mock:
+            return self._mock_response(prompt)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(BEDROCK_POOL, self._call_claude, prompt)
+
+    def run(self, query, on_token=None):
+        return asyncio.run(self.arun(query, on_token=on_token))
+
+    # Retrieval and the most likely cost query start straight away; prefetched tool
+    # results are kept if the plan asks for them and dropped otherwise.
+    def _speculate(self, query):
+        if not SPECULATIVE_EXECUTION:
+            return _Prefetch()
+        tool, _ = self.router.rule_route(query)
+        tool = TOOL_DEPENDENCIES.get(tool, (tool,))[0]
+        self.speculation_stats["prefetched"] += 1
+        return _Prefetch({tool: asyncio.create_task(self._call_tool(tool))})
+
+    # Retrieval, the speculative tool call and the cost-data fingerprint all start
+    # before the answer cache is consulted, so a cache miss has lost no time to the
+    # check; on a hit the in-flight work is dropped. Stage timings are wall-clock ms
+    # summed over attempts; retrieval runs alongside the other stages, so it is
+    # measured from launch to completion on its own.
+    async def arun(self, query, on_token=None):
         logger.info(f"New query received: {query[:100]}")
-        kb_chunks = self.rag.retrieve(query, top_k=3)
-        logger.info(f"Retrieved {len(kb_chunks)} KB chunks")
+        started      = time.perf_counter()
+        timings      = {"retrieve": 0.0, "reason": 0.0, "tools": 0.0, "answer": 0.0, "reflect": 0.0}
+        prefetch     = self._speculate(query)
+        fingerprint  = asyncio.create_task(asyncio.to_thread(cost_data_fingerprint)) if self.answer_cache is not None else None
+        query_vector = (await self.answer_cache.embed_fn.acall([query]))[0] if self.answer_cache is not None else None
+        retrieval    = asyncio.create_task(self.rag.aretrieve(query, top_k=3, query_embedding=query_vector))
+        retrieval.add_done_callback(lambda _: timings.__setitem__("retrieve", (time.perf_counter() - started) * 1000))
+        try:
+            if fingerprint is not None:
+                cached, _ = await self.answer_cache.lookup(query, await fingerprint, query_vector)
+                if cached is not None:
+                    logger.info("Answer served from semantic cache")
+                    if on_token:
+                        on_token(cached["answer"])
+                    return dict(cached, query=query, cached=True, timings={"total": round((time.perf_counter() - started) * 1000, 1)})
+            result = await self._arun_uncached(query, on_token, query_vector, retrieval, prefetch, timings, started)
+        finally:
+            self._release(prefetch, retrieval, fingerprint)
+        if self.answer_cache is not None and result and not result["reflection"].get("should_retry"):
+            self.answer_cache.store(query, query_vector, fingerprint.result(), result)
+        return result
 
+    def _release(self, prefetch, retrieval, fingerprint=None):
+        for name, task in prefetch.tasks.items():
+            if name in prefetch.used:
+                self.speculation_stats["used"] += 1
+            else:
+                self.speculation_stats["discarded"] += 1
+                task.cancel()
+        for task in (retrieval, fingerprint):
+            if task is not None and not task.done():
+                task.cancel()
+
+    async def _arun_uncached(self, query, on_token, query_vector, retrieval, prefetch, timings, started):
+        def lap(stage, since):
+            now = time.perf_counter()
+            timings[stage] += (now - since) * 1000
+            return now
+
+        kb_chunks = None if SPECULATIVE_EXECUTION else await retrieval
         for attempt in range(1, self.MAX_RETRIES + 1):
             logger.info(f"Reasoning attempt {attempt} of {self.MAX_RETRIES}")
-            plan = self._reason(query, kb_chunks)
-            logger.info(f"Tool selected: {plan.get('primary_tool')}")
-            tool_output = self._execute_plan(plan)
-            answer = self._generate_answer(query, kb_chunks, plan, tool_output)
+            mark = time.perf_counter()
+            if attempt == 1:
+                plan = await self.router.route(query, lambda: self._plan_with_kb(query, retrieval, kb_chunks), query_vector)
+            else:
+                plan = await self._reason(query, kb_chunks)
+            mark = lap("reason", mark)
+            logger.info(f"Tool selected: {plan.get('primary_tool')} via {plan.get('router', 'llm')}")
+            tool_output = await self._execute_plan(plan, prefetch)
+            mark = lap("tools", mark)
+            if kb_chunks is None:
+                kb_chunks = await retrieval
+                mark = time.perf_counter()
+            logger.info(f"Retrieved {len(kb_chunks)} KB chunks")
+            if on_token and attempt > 1:
+                on_token("\n\n---\n\n")
+            answer = await self._generate_answer(query, kb_chunks, plan, tool_output, on_token)
+            mark = lap("answer", mark)
             logger.info(f"Answer generated: {len(answer)} characters")
-            reflection = self._reflect(query, answer)
-            logger.info(f"Reflection score: {reflection['score']}/10")
+            reflection = await self._reflect(query, answer, tool_output)
+            lap("reflect", mark)
+            logger.info(f"Reflection score: {reflection['score']}/10 ({reflection.get('judge', 'llm')} judge)")
 
             if not reflection["should_retry"] or attempt == self.MAX_RETRIES:
                 return {
@@ -185,12 +369,22 @@ class AzureCostAgent:
                     "kb_sources":  [c["source"] for c in kb_chunks],
                     "reflection":  reflection,
                     "attempts":    attempt,
+                    "timings":     dict({k: round(v, 1) for k, v in timings.items()}, total=round((time.perf_counter() - started) * 1000, 1)),
                 }
             logger.warning("Score below threshold - retrying")
         return {}
 
-    def _reason(self, query, kb_chunks):
-        kb_text = "\n\n".join(f"[{c['source']}]\n{c['text']}" for c in kb_chunks)
+    # Only reached when the rule and nearest-neighbour routers abstain. The LLM call
+    # dominates this path, so retrieval gets up to PLANNER_KB_WAIT_MS to land and give
+    # the planner KB context; past that the planner goes without it.
+    async def _plan_with_kb(self, query, retrieval, kb_chunks):
+        if kb_chunks is None:
+            done, _ = await asyncio.wait({retrieval}, timeout=PLANNER_KB_WAIT_MS / 1000)
+            kb_chunks = retrieval.result() if done and retrieval.exception() is None else []
+        return await self._reason(query, kb_chunks)
+
+    async def _reason(self, query, kb_chunks):
+        kb_text = "\n\n".join(f"[{c['source']}]\n{c['text']}" for c in fit_kb(kb_chunks, PLANNER_KB_TOKEN_BUDGET))
         prompt = (
             "You are an Azure FinOps expert AI agent.\n"
             f"User Question: {query}\n"
@@ -199,40 +393,77 @@ class AzureCostAgent:
             "Decide which tool to call.\n"
             "If question is about optimisation set primary_tool=get_cost_by_service and secondary_tool=suggest_optimisations.\n"
             "Otherwise set primary_tool only and secondary_tool to null.\n"
-            'Respond ONLY with valid JSON no markdown: {"primary_tool": "<tool_name>", "secondary_tool": "<tool_name or null>", "reasoning": "<one sentence why>"}'
+            "If the question needs several views list every tool in tools; they run in parallel.\n"
+            'Respond ONLY with valid JSON no markdown: {"primary_tool": "<tool_name>", "secondary_tool": "<tool_name or null>", "tools": ["<tool_name>", ...], "reasoning": "<one sentence why>"}'
         )
-        raw = self._call_claude(prompt).strip().replace("```json", "").replace("```", "").strip()
+        raw = (await self._acall_claude(prompt)).strip().replace("```json", "").replace("```", "").strip()
         try:
             return json.loads(raw)
         except Exception:
             return {"primary_tool": "get_cost_by_service", "secondary_tool": None, "reasoning": raw[:200]}
 
-    def _execute_plan(self, plan):
-        primary_tool = plan.get("primary_tool")
-        if primary_tool == "suggest_optimisations":
-            cost_data = get_cost_by_service()
-            return {"cost_data": cost_data, "optimisations": suggest_optimisations(cost_data=cost_data)}
-        primary_fn  = TOOL_MAP.get(primary_tool, get_cost_by_service)
-        primary_out = primary_fn()
-        secondary   = plan.get("secondary_tool")
-        if secondary == "suggest_optimisations":
-            return {"cost_data": primary_out, "optimisations": suggest_optimisations(cost_data=primary_out)}
-        return primary_out
-
-    def _generate_answer(self, query, kb_chunks, plan, tool_output):
+    def _plan_tools(self, plan):
+        names = plan.get("tools") or [plan.get("primary_tool"), plan.get("secondary_tool")]
+        tools = []
+        for name in names:
+            if name in TOOL_MAP and name not in tools:
+                tools.append(name)
+        return tools or ["get_cost_by_service"]
+
+    async def _call_tool(self, name, **kwargs):
+        return await asyncio.to_thread(TOOL_MAP[name], **kwargs)
+
+    async def _execute_plan(self, plan, prefetch=None):
+        prefetch = prefetch or _Prefetch()
+        tools = self._plan_tools(plan)
+        independent = [t for t in tools if t not in TOOL_DEPENDENCIES]
+        for t in tools:
+            dep = TOOL_DEPENDENCIES.get(t)
+            if dep and dep[0] not in independent:
+                independent.append(dep[0])
+        results = await asyncio.gather(*(prefetch.take(name) or self._call_tool(name) for name in independent))
+        outputs = dict(zip(independent, results))
+        for t in tools:
+            if t in TOOL_DEPENDENCIES:
+                dep, arg = TOOL_DEPENDENCIES[t]
+                outputs[t] = await self._call_tool(t, **{arg: outputs[dep]})
+        if "suggest_optimisations" in outputs:
+            result = {"cost_data": outputs.pop("get_cost_by_service"), "optimisations": outputs.pop("suggest_optimisations")}
+            result.update(outputs)
+            return result
+        if len(outputs) == 1:
+            return next(iter(outputs.values()))
+        return outputs
+
+    async def _generate_answer(self, query, kb_chunks, plan, tool_output, on_token=None):
         if self.use_mock:
-            return self._mock_response(query)
-        kb_text = "\n\n".join(c["text"] for c in kb_chunks)
-        prompt = (
+            prompt = query
+        else:
+            prompt = self._answer_prompt(query, kb_chunks, tool_output)
+        if on_token is None:
+            return (await self._acall_claude(prompt)).strip()
+        parts = []
+        async for text in self._astream_claude(prompt):
+            parts.append(text)
+            on_token(text)
+        return "".join(parts).strip()
+
+    def _answer_prompt(self, query, kb_chunks, tool_output):
+        template = (
             "You are an Azure FinOps assistant.\n"
             f"User Question: {query}\n"
-            f"Knowledge: {kb_text}\n"
-            f"Cost Data: {json.dumps(tool_output, indent=2)}\n"
+            "Knowledge: {knowledge}\n"
+            "Cost Data:\n{tool_data}\n"
             "Guidelines: Start with key number. Use bullet points. Show savings in USD. Keep under 250 words. Mention demo data if source is mock."
         )
-        return self._call_claude(prompt).strip()
+        prompt, metrics = assemble(template, tool_output, kb_chunks)
+        logger.info(f"Answer prompt assembled: {metrics}")
+        return prompt
+
+    async def _reflect(self, query, answer, tool_output=None):
+        return await self.reflection.reflect(query, answer, tool_output)
 
-    def _reflect(self, query, answer):
+    async def _llm_reflect(self, query, answer):
         prompt = (
             "Rate this Azure cost analysis response 0-10.\n"
             f"Question: {query}\n"
@@ -240,7 +471,7 @@ class AzureCostAgent:
             "Score: answers question (3pts) + dollar amounts (3pts) + actionable (2pts) + clear (2pts).\n"
             'Respond ONLY with JSON: {"score": 0, "reason": "one sentence", "should_retry": false}'
         )
-        raw = self._call_claude(prompt).strip().replace("```json", "").replace("```", "").strip()
+        raw = (await self._acall_claude(prompt)).strip().replace("```json", "").replace("```", "").strip()
         try:
             return json.loads(raw)
         except Exception:
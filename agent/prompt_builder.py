@@ -0,0 +1,137 @@
+import json
+import math
+from agent.config import PROMPT_TOKEN_BUDGET, PROMPT_MAX_ROWS
+
+CHARS_PER_TOKEN = 4
+MIN_ROWS        = 5
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _is_table(value):
+    return isinstance(value, list) and value and all(isinstance(r, dict) for r in value)
+
+
+def _row_key(row):
+    return json.dumps(row, sort_keys=True, default=str)
+
+
+# Scalar lists and small dicts (e.g. services, tags) stay in one cell as a;b and k=v;k=v
+def _cell(value):
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, dict):
+        return ";".join(f"{k}={_cell(v)}" for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return ";".join(_cell(v) for v in value)
+    return str(value).replace(",", " ")
+
+
+def _cost_column(columns):
+    for c in ("cost_usd", "est_saving_usd", "current_cost"):
+        if c in columns:
+            return c
+    return None
+
+
+# Columns holding lists of rows (e.g. top_resources) become a child table keyed by
+# the parent's first column instead of being flattened into one cell.
+def _table(name, rows, max_rows):
+    columns = list(dict.fromkeys(c for r in rows for c in r))
+    nested  = [c for c in columns if any(_is_table(r.get(c)) for r in rows)]
+    columns = [c for c in columns if c not in nested]
+    lines, cost_col, table = [], _cost_column(columns), name
+    if len(rows) > max_rows and cost_col:
+        costs = [float(r.get(cost_col) or 0) for r in rows]
+        lines.append(
+            f"{name}_summary: rows={len(rows)} sum={sum(costs):.2f} mean={sum(costs) / len(costs):.2f} "
+            f"min={min(costs):.2f} max={max(costs):.2f}"
+        )
+        rows = sorted(rows, key=lambda r: float(r.get(cost_col) or 0), reverse=True)[:max_rows]
+        name = f"{name}_top{max_rows}"
+    elif len(rows) > max_rows:
+        rows = rows[:max_rows]
+        name = f"{name}_first{max_rows}"
+    lines.append(f"{name}[{len(rows)}]{{{','.join(columns)}}}:")
+    lines.extend(",".join(_cell(r.get(c, "")) for c in columns) for r in rows)
+    for col in nested:
+        key      = columns[0]
+        children = [dict({key: r.get(key)}, **child) for r in rows for child in (r.get(col) or [])]
+        if children:
+            lines.extend(_table(f"{table}.{col}", children, max_rows))
+    return lines
+
+
+def _serialise(value, prefix, max_rows, seen, lines):
+    for key, item in value.items():
+        name = f"{prefix}{key}"
+        if isinstance(item, dict):
+            _serialise(item, f"{name}.", max_rows, seen, lines)
+        elif _is_table(item):
+            keys = [_row_key(r) for r in item]
+            owner = next((t for t, rows in seen.items() if all(k in rows for k in keys)), None)
+            if owner:
+                # e.g. anomaly_days repeats rows of daily: reference them by first column
+                first = next(iter(item[0]))
+                lines.append(f"{name}: see {owner} ({first}={';'.join(_cell(r.get(first)) for r in item)})")
+                continue
+            seen[name] = set(keys)
+            lines.extend(_table(name, item, max_rows))
+        elif isinstance(item, list):
+            lines.append(f"{name}: {';'.join(_cell(v) for v in item)}")
+        else:
+            lines.append(f"{name}: {_cell(item)}")
+    return lines
+
+
+# Tool output as compact CSV-like blocks: no indentation, one header per table,
+# repeated rows referenced instead of re-sent, long tables summarised to the top rows.
+def compact_tool_output(tool_output, max_rows=PROMPT_MAX_ROWS):
+    if not isinstance(tool_output, dict):
+        return json.dumps(tool_output, separators=(",", ":"), default=str)
+    return "\n".join(_serialise(tool_output, "", max_rows, {}, []))
+
+
+def fit_kb(kb_chunks, token_budget):
+    parts, used = [], 0
+    for chunk in sorted(kb_chunks, key=lambda c: c.get("score", c.get("similarity", 0)), reverse=True):
+        text = chunk["text"]
+        remaining = token_budget - used
+        if remaining <= 0:
+            break
+        if estimate_tokens(text) > remaining:
+            text = text[:remaining * CHARS_PER_TOKEN]
+        parts.append(dict(chunk, text=text))
+        used += estimate_tokens(text)
+    return parts
+
+
+def _fill(template, tool_data, knowledge):
+    return template.replace("{tool_data}", tool_data).replace("{knowledge}", knowledge)
+
+
+# Keeps template + tool data + knowledge under token_budget. Tool tables may use up to
+# 60% of what the template leaves (the row limit halves until they fit); knowledge
+# chunks fill the rest in similarity order.
+def assemble(template, tool_output, kb_chunks, token_budget=PROMPT_TOKEN_BUDGET, max_rows=PROMPT_MAX_ROWS):
+    fixed = estimate_tokens(_fill(template, "", ""))
+    tool_text = compact_tool_output(tool_output, max_rows) if tool_output is not None else ""
+    while estimate_tokens(tool_text) > (token_budget - fixed) * 0.6 and max_rows > MIN_ROWS:
+        max_rows = max(MIN_ROWS, max_rows // 2)
+        tool_text = compact_tool_output(tool_output, max_rows)
+    kb_budget = max(0, token_budget - fixed - estimate_tokens(tool_text))
+    kb_chunks = fit_kb(kb_chunks, kb_budget)
+    knowledge = "\n\n".join(c["text"] for c in kb_chunks)
+    prompt = _fill(template, tool_text, knowledge)
+    metrics = {
+        "prompt_tokens": estimate_tokens(prompt),
+        "tool_tokens":   estimate_tokens(tool_text),
+        "kb_tokens":     estimate_tokens(knowledge),
+        "kb_chunks":     len(kb_chunks),
+        "max_rows":      max_rows,
+    }
+    return prompt, metrics
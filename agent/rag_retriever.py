@@ -1,19 +1,33 @@
 import os
+import re
 import json
+import asyncio
+import time
+import random
 import hashlib
 import boto3
-import chromadb
+import numpy as np
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from pathlib import Path
-from agent.config import DEMO_MODE, AWS_REGION
+from agent.config import DEMO_MODE, AWS_REGION, EMBED_WORKERS, EMBED_MAX_IN_FLIGHT, EMBED_CACHE_ENABLED, EMBED_CACHE_PATH, KB_WATCH_INTERVAL_SEC, VECTOR_BACKEND
+from agent.config import RETRIEVAL_HYBRID, RETRIEVAL_CANDIDATES, RETRIEVAL_MIN_SCORE, RRF_K
+from agent.hybrid_search import BM25Index, STOPWORDS, rrf_fuse, rerank_score, tokenize
+from agent.vector_store import make_store
+from agent.embedding_cache import EmbeddingCache, text_digest
 
 DOCS_DIR        = Path(__file__).parent.parent / "runbooks"
-CHROMA_PATH     = Path(__file__).parent.parent / "data" / "chroma_db"
-COLLECTION_NAME = "azure_cost_kb"
+TITAN_MODEL_ID  = "amazon.titan-embed-text-v2:0"
+MOCK_MODEL_ID   = "mock-numpy-gauss-256-v1"
+MOCK_DIM        = 256
 CHUNK_SIZE      = 500
 CHUNK_OVERLAP   = 100
+EMBED_MAX_RETRIES  = 6
+RETRYABLE_ERRORS   = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException", "ModelNotReadyException"}
+PROGRESS_EVERY     = 100
 
 
-class TitanEmbeddingFunction(chromadb.EmbeddingFunction):
+class TitanEmbeddingFunction:
 
     def __init__(self):
         self.use_mock = DEMO_MODE
@@ -27,66 +41,250 @@ class TitanEmbeddingFunction(chromadb.EmbeddingFunction):
                 print("Falling back to mock embeddings")
         else:
             print("Demo mode - using mock embeddings")
+        self.model_id = MOCK_MODEL_ID if self.use_mock else TITAN_MODEL_ID
+        # Mock vectors are cheaper to regenerate than to read back from disk
+        self.cache    = EmbeddingCache(EMBED_CACHE_PATH, self.model_id) if EMBED_CACHE_ENABLED and not self.use_mock else None
 
-    def _mock_embedding(self, text):
-        import random
-        seed = int(hashlib.md5(text.encode()).hexdigest(), 16) % (2**32)
-        rng  = random.Random(seed)
-        vec  = [rng.gauss(0, 1) for _ in range(256)]
-        mag  = sum(x**2 for x in vec) ** 0.5
-        return [x / mag for x in vec]
+    # One seeded Gaussian row per text, normalised as a single matrix. Bump
+    # MOCK_MODEL_ID whenever the generator changes so old indexes are rebuilt.
+    def _mock_embed_batch(self, texts):
+        mat = np.empty((len(texts), MOCK_DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int(hashlib.md5(text.encode()).hexdigest(), 16) % (2**32)
+            mat[i] = np.random.default_rng(seed).standard_normal(MOCK_DIM, dtype=np.float32)
+        mat /= np.linalg.norm(mat, axis=1, keepdims=True)
+        return mat.tolist()
+
+    def _embed_one(self, text):
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            try:
+                response = self.client.invoke_model(
+                    modelId=TITAN_MODEL_ID,
+                    body=json.dumps({"inputText": text}),
+                    contentType="application/json",
+                    accept="application/json",
+                )
+                break
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code", "")
+                if code not in RETRYABLE_ERRORS or attempt == EMBED_MAX_RETRIES:
+                    raise
+                time.sleep(random.uniform(0, min(20.0, 0.5 * 2 ** attempt)))
+        result = json.loads(response["body"].read())
+        return result["embedding"]
+
+    # Keeps at most EMBED_MAX_IN_FLIGHT requests outstanding across EMBED_WORKERS
+    # threads; results come back in input order.
+    def _compute_many(self, texts, progress=None):
+        if self.use_mock:
+            return self._mock_embed_batch(texts)
+        results = [None] * len(texts)
+        pending = {}
+        done_count = 0
+        with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as pool:
+            for i, text in enumerate(texts):
+                if len(pending) >= EMBED_MAX_IN_FLIGHT:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in finished:
+                        results[pending.pop(f)] = f.result()
+                        done_count += 1
+                        if progress:
+                            progress(done_count, len(texts))
+                pending[pool.submit(self._embed_one, text)] = i
+            for f in as_completed(list(pending)):
+                results[pending.pop(f)] = f.result()
+                done_count += 1
+                if progress:
+                    progress(done_count, len(texts))
+        return results
+
+    def _from_cache(self, texts):
+        if self.cache is None:
+            return [None] * len(texts), list(range(len(texts))), []
+        digests = [text_digest(t) for t in texts]
+        found   = self.cache.get_many(digests)
+        vectors = [found.get(d) for d in digests]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        return vectors, missing, digests
+
+    def _store(self, vectors, missing, digests, computed):
+        for i, vec in zip(missing, computed):
+            vectors[i] = vec
+        if self.cache is not None:
+            self.cache.put_many({digests[i]: vectors[i] for i in missing}.items())
+        return vectors
+
+    # progress(done, total) counts cache hits as done, so it runs over all of texts
+    def embed_many(self, texts, progress=None):
+        vectors, missing, digests = self._from_cache(texts)
+        hits     = len(texts) - len(missing)
+        report   = (lambda done, _: progress(hits + done, len(texts))) if progress else None
+        computed = self._compute_many([texts[i] for i in missing], report) if missing else []
+        vectors  = self._store(vectors, missing, digests, computed)
+        if progress:
+            progress(len(texts), len(texts))
+        return vectors
 
     def __call__(self, input):
+        return self.embed_many(list(input))
+
+    async def acall(self, input):
+        vectors, missing, digests = self._from_cache(list(input))
         if self.use_mock:
-            return [self._mock_embedding(t) for t in input]
-        embeddings = []
-        for text in input:
-            response = self.client.invoke_model(
-                modelId="amazon.titan-embed-text-v2:0",
-                body=json.dumps({"inputText": text}),
-                contentType="application/json",
-                accept="application/json",
-            )
-            result = json.loads(response["body"].read())
-            embeddings.append(result["embedding"])
-        return embeddings
+            computed = self._mock_embed_batch([input[i] for i in missing])
+        else:
+            computed = await asyncio.gather(*(asyncio.to_thread(self._embed_one, input[i]) for i in missing))
+        return self._store(vectors, missing, digests, list(computed))
+
+    def stats(self):
+        return self.cache.stats() if self.cache is not None else {}
 
 
 class RAGRetriever:
 
     def __init__(self):
-        self._embed_fn = TitanEmbeddingFunction()
-        CHROMA_PATH.mkdir(parents=True, exist_ok=True)
-        client    = chromadb.PersistentClient(path=str(CHROMA_PATH))
-        self._col = client.get_or_create_collection(
-            name=COLLECTION_NAME,
-            embedding_function=self._embed_fn,
-            metadata={"hnsw:space": "cosine"},
-        )
-        if self._col.count() == 0:
-            print("Indexing Azure cost knowledge base...")
-            self._index()
+        self._embed_fn      = TitanEmbeddingFunction()
+        self._store         = make_store(VECTOR_BACKEND, self._embed_fn)
+        self._bm25          = None
+        self._progress_done = 0
+        self._manifest      = None
+        self.sync()
+
+    # Stores without a manifest_path (the in-memory backend) keep it in process, so
+    # repeat syncs in the same run are still incremental
+    def _load_manifest(self):
+        if self._store.manifest_path is None:
+            return self._manifest
+        try:
+            return json.loads(self._store.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _save_manifest(self, files):
+        manifest = {
+            "model_id":      self._embed_fn.model_id,
+            "chunk_size":    CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "files":         files,
+        }
+        self._manifest = manifest
+        path = self._store.manifest_path
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        tmp.replace(path)
+
+    # The manifest only describes the store if both hold the same chunk ids; a store
+    # wiped or rebuilt behind the manifest's back would otherwise stay as it is.
+    def _manifest_matches(self, manifest):
+        expected = {cid for entry in manifest.get("files", {}).values() for cid in entry["ids"]}
+        return self._store.count() == len(expected) and set(self._store.ids()) == expected
+
+    # Re-chunks and re-embeds only runbooks whose content hash changed since the
+    # manifest was written, and drops chunk ids of edited or removed files. A
+    # different embedding model or chunking setup, or a store that no longer holds
+    # the manifest's chunks, invalidates the whole index.
+    def sync(self):
+        t0       = time.perf_counter()
+        manifest = self._load_manifest()
+        if manifest is None or manifest.get("model_id") != self._embed_fn.model_id \
+                or manifest.get("chunk_size") != CHUNK_SIZE or manifest.get("chunk_overlap") != CHUNK_OVERLAP:
+            if self._store.count():
+                print("Embedding model or chunking changed - rebuilding knowledge base")
+                self._store.delete(self._store.ids())
+            old_files = {}
+        elif not self._manifest_matches(manifest):
+            print("Knowledge base store does not match its manifest - rebuilding")
+            if self._store.count():
+                self._store.delete(self._store.ids())
+            old_files = {}
         else:
-            print(f"KB loaded with {self._col.count()} chunks ready")
+            old_files = manifest["files"]
 
-    def _index(self):
-        docs, ids, metas = [], [], []
-        for f in DOCS_DIR.glob("*.md"):
+        files, changed = {}, []
+        for f in sorted(DOCS_DIR.glob("*.md")):
             text   = f.read_text(encoding="utf-8")
-            chunks = self._chunk(text)
-            for i, chunk in enumerate(chunks):
-                cid = hashlib.md5(f"{f.name}_{i}".encode()).hexdigest()
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            prev   = old_files.get(f.name)
+            if prev and prev["sha256"] == digest:
+                files[f.name] = prev
+                continue
+            changed.append((f.name, text, digest))
+
+        present = set(files) | {name for name, _, _ in changed}
+        removed = [name for name in old_files if name not in present]
+        stale   = [cid for name in removed for cid in old_files[name]["ids"]]
+        stale  += [cid for name, _, _ in changed if name in old_files for cid in old_files[name]["ids"]]
+        if stale:
+            self._store.delete(stale)
+
+        docs, ids, metas = [], [], []
+        for name, text, digest in changed:
+            file_ids = []
+            for i, chunk in enumerate(self._chunk(text)):
+                cid = hashlib.md5(f"{name}_{i}".encode()).hexdigest()
                 docs.append(chunk)
                 ids.append(cid)
-                metas.append({"source": f.name, "chunk": i})
-        batch = 5
-        for s in range(0, len(docs), batch):
-            self._col.add(
-                documents=docs[s:s+batch],
-                ids=ids[s:s+batch],
-                metadatas=metas[s:s+batch],
-            )
-        print(f"Indexed {len(docs)} chunks from {len(list(DOCS_DIR.glob('*.md')))} docs")
+                metas.append({"source": name, "chunk": i})
+                file_ids.append(cid)
+            files[name] = {"sha256": digest, "ids": file_ids}
+        if docs:
+            print(f"Indexing {len(changed)} changed runbook(s)...")
+            self._add(docs, ids, metas)
+
+        self._store.flush()
+        if self._bm25 is None or docs or stale:
+            self._bm25 = BM25Index.build(*self._store.documents()) if RETRIEVAL_HYBRID else None
+        self._save_manifest(files)
+        elapsed = time.perf_counter() - t0
+        result  = {
+            "changed_files":  len(changed),
+            "removed_files":  len(removed),
+            "unchanged":      len(files) - len(changed),
+            "chunks_added":   len(docs),
+            "chunks_deleted": len(stale),
+            "seconds":        round(elapsed, 3),
+        }
+        if docs or stale:
+            rate = len(docs) / elapsed if elapsed > 0 else 0.0
+            print(f"Indexed {len(docs)} chunks from {len(changed)} docs, removed {len(stale)} stale chunks in {elapsed:.1f}s ({rate:.1f} chunks/sec)")
+        print(f"KB loaded with {self._store.count()} chunks ready")
+        return result
+
+    def _add(self, docs, ids, metas):
+        self._progress_done = 0
+        embeddings = self._embed_fn.embed_many(docs, progress=self._report_progress)
+        self._store.add(ids, docs, embeddings, metas)
+
+    @staticmethod
+    def _snapshot():
+        return {f.name: (f.stat().st_mtime_ns, f.stat().st_size) for f in DOCS_DIR.glob("*.md")}
+
+    # Polls runbooks/ and syncs whenever a file is added, edited or removed.
+    def watch(self, interval=KB_WATCH_INTERVAL_SEC):
+        print(f"Watching {DOCS_DIR} for changes (every {interval}s, Ctrl+C to stop)")
+        last = self._snapshot()
+        try:
+            while True:
+                time.sleep(interval)
+                current = self._snapshot()
+                if current != last:
+                    last = current
+                    self.sync()
+        except KeyboardInterrupt:
+            pass
+
+    # Prints each time done crosses a multiple of PROGRESS_EVERY (completions arrive
+    # in batches, so exact multiples are often skipped) and once at the end
+    def _report_progress(self, done, total):
+        last = self._progress_done
+        if done == last:
+            return
+        if done == total or done // PROGRESS_EVERY > last // PROGRESS_EVERY:
+            print(f"Embedded {done}/{total} chunks")
+        self._progress_done = done
 
     def _chunk(self, text):
         chunks, start = [], 0
@@ -96,20 +294,46 @@ class RAGRetriever:
         return [c for c in chunks if len(c) > 50]
 
     def retrieve(self, query, top_k=3):
-        query_embedding = self._embed_fn([query])[0]
-        res = self._col.query(
-            query_embeddings=[query_embedding],
-            n_results=min(top_k, self._col.count()),
-        )
-        chunks = []
-        for text, meta, dist in zip(
-            res["documents"][0],
-            res["metadatas"][0],
-            res["distances"][0],
-        ):
-            chunks.append({
+        return self._search(query, self._embed_fn([query])[0], top_k)
+
+    async def aretrieve(self, query, top_k=3, query_embedding=None):
+        if query_embedding is None:
+            query_embedding = (await self._embed_fn.acall([query]))[0]
+        return await asyncio.to_thread(self._search, query, query_embedding, top_k)
+
+    def _search(self, query, query_embedding, top_k):
+        if self._bm25 is None:
+            return [
+                {"text": hit["text"], "source": hit["metadata"]["source"], "similarity": round(hit["similarity"], 4)}
+                for hit in self._store.query(query_embedding, top_k)
+            ]
+        return self._hybrid_search(query, query_embedding, top_k)
+
+    # Vector and BM25 candidates fused by reciprocal rank, re-scored locally and cut
+    # at RETRIEVAL_MIN_SCORE (the best chunk is always kept), so exact-term queries
+    # reach the prompt and weak semantic matches do not.
+    def _hybrid_search(self, query, query_embedding, top_k):
+        n_candidates = max(top_k, RETRIEVAL_CANDIDATES)
+        vector_hits  = {hit["id"]: hit for hit in self._store.query(query_embedding, n_candidates)}
+        lexical_hits = self._bm25.search(query, n_candidates)
+        fused = rrf_fuse([list(vector_hits), [cid for cid, _ in lexical_hits]], k=RRF_K)
+        if not fused:
+            return []
+
+        words  = [w for w in re.findall(r"[a-z0-9][a-z0-9\-]*", query.lower()) if w not in STOPWORDS]
+        phrase = " ".join(words) if len(words) > 1 else ""
+        terms  = {t: self._bm25.idf(t) for t in tokenize(query)}
+        max_fused = 2.0 / (RRF_K + 1)
+        ranked = []
+        for cid, score in fused.items():
+            hit = vector_hits.get(cid)
+            text, meta = (hit["text"], hit["metadata"]) if hit else self._bm25.docs[cid]
+            similarity = hit["similarity"] if hit else 0.0
+            ranked.append({
                 "text":       text,
                 "source":     meta["source"],
-                "similarity": round(1 - dist, 4),
+                "similarity": round(similarity, 4),
+                "score":      rerank_score(terms, phrase, text, score, max_fused, similarity),
             })
-        return chunks
\ No newline at end of file
+        ranked.sort(key=lambda c: c["score"], reverse=True)
+        return [c for i, c in enumerate(ranked[:top_k]) if i == 0 or c["score"] >= RETRIEVAL_MIN_SCORE]
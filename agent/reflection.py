@@ -0,0 +1,88 @@
+import re
+from agent.config import REFLECTION_ACCEPT_SCORE, REFLECTION_RETRY_SCORE
+
+USD_PATTERN    = re.compile(r"\$\s?\d[\d,]*(?:\.\d+)?|\b\d[\d,]*(?:\.\d+)?\s?USD\b", re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?")
+WORD_PATTERN   = re.compile(r"[a-z][a-z\-]+")
+STOPWORDS = {
+    "what", "which", "where", "when", "were", "there", "that", "this", "with", "have", "from",
+    "does", "should", "could", "would", "about", "many", "much", "most", "last", "azure",
+    "cost", "costs", "spend", "the", "and", "for", "any", "are", "how", "can", "my", "our",
+}
+
+
+def _tool_numbers(value, out):
+    if isinstance(value, bool):
+        return out
+    if isinstance(value, (int, float)):
+        if abs(value) >= 1:
+            out.append(float(value))
+    elif isinstance(value, dict):
+        for v in value.values():
+            _tool_numbers(v, out)
+    elif isinstance(value, list):
+        for v in value:
+            _tool_numbers(v, out)
+    return out
+
+
+def _answer_numbers(answer):
+    values = set()
+    for match in NUMBER_PATTERN.findall(answer):
+        try:
+            v = float(match.replace(",", ""))
+        except ValueError:
+            continue
+        values.add(round(v, 2))
+        values.add(float(round(v)))
+    return values
+
+
+# Scores the same rubric as the LLM judge (answers question 3, dollar amounts 3,
+# actionable/grounded 2, clear 2) from the text alone. Only answers that land between
+# the retry and accept thresholds are sent to the LLM judge.
+class ReflectionEngine:
+
+    def __init__(self, judge, accept_score=REFLECTION_ACCEPT_SCORE, retry_score=REFLECTION_RETRY_SCORE):
+        self.judge        = judge
+        self.accept_score = accept_score
+        self.retry_score  = retry_score
+        self.stats        = {"local_accept": 0, "local_retry": 0, "llm_judge": 0}
+
+    def pre_score(self, query, answer, tool_output=None):
+        usd_hits = len(USD_PATTERN.findall(answer))
+        usd = min(3.0, 1.5 * usd_hits)
+
+        expected = sorted(set(round(v, 2) for v in _tool_numbers(tool_output, [])), reverse=True)[:10]
+        if expected:
+            found = _answer_numbers(answer)
+            hits = sum(1 for v in expected if v in found or float(round(v)) in found)
+            grounded = 2.0 * min(1.0, hits / min(3, len(expected)))
+        else:
+            grounded = 2.0 if usd_hits else 0.0
+
+        terms = {w[:5] for w in WORD_PATTERN.findall(query.lower()) if len(w) > 3 and w not in STOPWORDS}
+        text = answer.lower()
+        coverage = sum(1 for t in terms if t in text) / len(terms) if terms else 1.0
+        relevance = 3.0 * coverage
+
+        words = len(answer.split())
+        clarity = 2.0 if 30 <= words <= 300 else (1.0 if 15 <= words <= 400 else 0.0)
+
+        score = round(usd + grounded + relevance + clarity, 1)
+        return score, {"usd": usd, "grounded": grounded, "relevance": round(relevance, 2), "clarity": clarity}
+
+    async def reflect(self, query, answer, tool_output=None):
+        score, parts = self.pre_score(query, answer, tool_output)
+        detail = ", ".join(f"{k} {v}" for k, v in parts.items())
+        if score >= self.accept_score:
+            self.stats["local_accept"] += 1
+            return {"score": round(score), "reason": f"Local rubric check passed ({detail})", "should_retry": False, "judge": "local"}
+        if score <= self.retry_score:
+            self.stats["local_retry"] += 1
+            return {"score": round(score), "reason": f"Local rubric check failed ({detail})", "should_retry": True, "judge": "local"}
+        self.stats["llm_judge"] += 1
+        verdict = await self.judge(query, answer)
+        verdict["judge"] = "llm"
+        verdict["local_score"] = score
+        return verdict
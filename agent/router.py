@@ -0,0 +1,117 @@
+import re
+import time
+from agent.config import ROUTER_CONFIDENCE, ROUTER_NEAREST_NEIGHBOUR
+from agent.vector_store import cosine_scores
+
+# Tier 1: regex rules over the question only. Each rule votes for one tool; a
+# question that matches a single tool is routed without any model call.
+ROUTE_RULES = [
+    (r"\b(resource groups?|teams?|environments?)\b[^.?!]*\b(spikes?|anomal\w*|unusual)\b"
+     r"|\b(spikes?|anomal\w*|unusual)\b[^.?!]*\b(resource groups?|teams?|environments?)\b", "get_resource_group_anomalies"),
+    (r"\b(spikes?|anomal\w*|unusual|trends?|daily|per day|which day|highest day|yesterday)\b", "get_daily_cost_trend"),
+    (r"\b(resource groups?|teams?|environments?|projects?)\b|\brg-", "get_cost_by_resource_group"),
+    (r"\b(reduc\w*|optimi[sz]\w*|sav(e|es|ing|ings)|cheaper|cut)\b", "suggest_optimisations"),
+    (r"\b(which service|services?|most expensive|costs? the most|total|biggest|reserved instances?)\b", "get_cost_by_service"),
+]
+
+# Tier 2: labelled example questions for nearest-neighbour routing.
+LABELLED_EXAMPLES = [
+    ("Which service costs the most?", "get_cost_by_service"),
+    ("What is my total Azure spend this month?", "get_cost_by_service"),
+    ("Show me a breakdown of spend by service", "get_cost_by_service"),
+    ("Should I use Reserved Instances?", "get_cost_by_service"),
+    ("Were there any cost spikes?", "get_daily_cost_trend"),
+    ("What is my daily average spend?", "get_daily_cost_trend"),
+    ("Which day had the highest Azure bill last month?", "get_daily_cost_trend"),
+    ("Is my spending trending up?", "get_daily_cost_trend"),
+    ("Break down costs by resource group", "get_cost_by_resource_group"),
+    ("How much is each team spending?", "get_cost_by_resource_group"),
+    ("What does production cost compared to staging?", "get_cost_by_resource_group"),
+    ("Which resource groups had cost spikes?", "get_resource_group_anomalies"),
+    ("Did any team's spending jump unexpectedly?", "get_resource_group_anomalies"),
+    ("How can I reduce my Azure costs?", "suggest_optimisations"),
+    ("Where can I save money on Azure?", "suggest_optimisations"),
+    ("Give me cost optimisation recommendations", "suggest_optimisations"),
+]
+
+
+class ToolRouter:
+
+    TIERS = ("rules", "nearest_neighbour", "llm")
+
+    def __init__(self, embed_fn=None, threshold=ROUTER_CONFIDENCE):
+        self.threshold = threshold
+        self.embed_fn  = embed_fn if ROUTER_NEAREST_NEIGHBOUR and embed_fn is not None and not getattr(embed_fn, "use_mock", False) else None
+        self._rules    = [(re.compile(p, re.IGNORECASE), tool) for p, tool in ROUTE_RULES]
+        self._examples = None
+        self._stats    = {tier: {"hits": 0, "total_ms": 0.0} for tier in self.TIERS}
+
+    def rule_route(self, query):
+        votes = {}
+        for pattern, tool in self._rules:
+            hits = len(pattern.findall(query))
+            if hits:
+                votes[tool] = votes.get(tool, 0) + hits
+        if not votes:
+            return "get_cost_by_service", 0.0
+        # Optimisation questions usually also mention services or totals; the
+        # optimisation tool already consumes the service breakdown.
+        if "suggest_optimisations" in votes:
+            votes.pop("get_cost_by_service", None)
+        # A per-resource-group spike question also trips the trend and resource group rules
+        if "get_resource_group_anomalies" in votes:
+            votes.pop("get_daily_cost_trend", None)
+            votes.pop("get_cost_by_resource_group", None)
+        if len(votes) > 1:
+            tool = max(votes, key=votes.get)
+            return tool, round(0.5 * votes[tool] / sum(votes.values()), 2)
+        tool = next(iter(votes))
+        return tool, round(min(0.95, 0.8 + 0.05 * votes[tool]), 2)
+
+    async def _nearest_neighbour(self, query, k=3, qvec=None):
+        if self._examples is None:
+            vectors = await self.embed_fn.acall([q for q, _ in LABELLED_EXAMPLES])
+            self._examples = [(v, tool) for v, (_, tool) in zip(vectors, LABELLED_EXAMPLES)]
+        if qvec is None:
+            qvec = (await self.embed_fn.acall([query]))[0]
+        sims   = cosine_scores(qvec, [v for v, _ in self._examples])
+        scored = sorted(((float(s), tool) for s, (_, tool) in zip(sims, self._examples)), reverse=True)[:k]
+        weights = {}
+        for sim, tool in scored:
+            weights[tool] = weights.get(tool, 0.0) + max(sim, 0.0)
+        total = sum(weights.values())
+        if not total:
+            return None, 0.0
+        tool = max(weights, key=weights.get)
+        return tool, scored[0][0] * weights[tool] / total
+
+    def _record(self, tier, t0):
+        self._stats[tier]["hits"] += 1
+        self._stats[tier]["total_ms"] += (time.perf_counter() - t0) * 1000
+
+    async def route(self, query, llm_planner, query_vector=None):
+        t0 = time.perf_counter()
+        tool, confidence = self.rule_route(query)
+        if confidence >= self.threshold:
+            self._record("rules", t0)
+            return {"primary_tool": tool, "secondary_tool": None, "reasoning": "keyword rules", "router": "rules", "confidence": round(confidence, 2)}
+        if self.embed_fn is not None:
+            tool, confidence = await self._nearest_neighbour(query, qvec=query_vector)
+            if tool and confidence >= self.threshold:
+                self._record("nearest_neighbour", t0)
+                return {"primary_tool": tool, "secondary_tool": None, "reasoning": "nearest labelled example", "router": "nearest_neighbour", "confidence": round(confidence, 2)}
+        plan = await llm_planner()
+        self._record("llm", t0)
+        plan["router"] = "llm"
+        return plan
+
+    def stats(self):
+        total = sum(s["hits"] for s in self._stats.values())
+        return {
+            tier: {
+                "hits":     s["hits"],
+                "hit_rate": round(s["hits"] / total, 4) if total else 0.0,
+                "avg_ms":   round(s["total_ms"] / s["hits"], 2) if s["hits"] else 0.0,
+            }
+            for tier, s in self._stats.items()
+        }
@@ -0,0 +1,242 @@
+import json
+import numpy as np
+from pathlib import Path
+from agent.config import VECTOR_ANN
+
+DATA_DIR           = Path(__file__).parent.parent / "data"
+CHROMA_PATH        = DATA_DIR / "chroma_db"
+NUMPY_STORE_PATH   = DATA_DIR / "vector_store"
+COLLECTION_NAME    = "azure_cost_kb"
+DEFAULT_BATCH_SIZE = 5000
+
+
+# Rows scaled to unit length (zero rows stay zero), so a dot product is a cosine
+def normalise(vectors):
+    mat   = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+# Cosine similarity of one vector against each row of vectors, as a float array
+def cosine_scores(vector, vectors):
+    if len(vectors) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return normalise(vectors) @ normalise([vector])[0]
+
+
+# What RAGRetriever needs from a backend. manifest_path is where the retriever keeps
+# its per-file hashes for this store; None means the store starts empty every run and
+# the manifest is kept in process.
+class VectorStore:
+
+    manifest_path = None
+
+    def add(self, ids, documents, embeddings, metadatas):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def ids(self):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    # (ids, texts, metadatas) for every stored chunk, used to build the BM25 index
+    def documents(self):
+        raise NotImplementedError
+
+    # Returns [{"id", "text", "metadata", "similarity"}] best first
+    def query(self, vector, top_k):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+
+class ChromaStore(VectorStore):
+
+    manifest_path = DATA_DIR / "kb_manifest.json"
+
+    def __init__(self, embed_fn, path=CHROMA_PATH):
+        # chromadb is slow to import, so deployments on the numpy store never load it
+        import chromadb
+
+        # Chroma validates that the collection's embedding function is one of its own
+        class _ChromaEmbeddingAdapter(chromadb.EmbeddingFunction):
+
+            def __init__(self, inner):
+                self.inner = inner
+
+            def __call__(self, input):
+                return self.inner(list(input))
+
+        path.mkdir(parents=True, exist_ok=True)
+        self._client = chromadb.PersistentClient(path=str(path))
+        self._col    = self._client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            embedding_function=_ChromaEmbeddingAdapter(embed_fn),
+            metadata={"hnsw:space": "cosine"},
+        )
+
+    def _batch_size(self):
+        try:
+            return self._client.get_max_batch_size()
+        except Exception:
+            return DEFAULT_BATCH_SIZE
+
+    def add(self, ids, documents, embeddings, metadatas):
+        batch = self._batch_size()
+        for s in range(0, len(ids), batch):
+            self._col.add(
+                documents=documents[s:s+batch],
+                embeddings=embeddings[s:s+batch],
+                ids=ids[s:s+batch],
+                metadatas=metadatas[s:s+batch],
+            )
+
+    def delete(self, ids):
+        batch = self._batch_size()
+        for s in range(0, len(ids), batch):
+            self._col.delete(ids=ids[s:s+batch])
+
+    def ids(self):
+        return self._col.get(include=[])["ids"]
+
+    def count(self):
+        return self._col.count()
+
+    def documents(self):
+        res = self._col.get(include=["documents", "metadatas"])
+        return res["ids"], res["documents"], res["metadatas"]
+
+    def query(self, vector, top_k):
+        n = min(top_k, self._col.count())
+        if n <= 0:
+            return []
+        res = self._col.query(query_embeddings=[vector], n_results=n)
+        return [
+            {"id": cid, "text": text, "metadata": meta, "similarity": 1 - dist}
+            for cid, text, meta, dist in zip(res["ids"][0], res["documents"][0], res["metadatas"][0], res["distances"][0])
+        ]
+
+
+# Unit vectors in one contiguous float32 matrix, searched exactly with a single
+# matrix-vector product. With a path the matrix is saved as .npy and memory-mapped
+# on load next to a JSON file of ids, texts and metadata; without one it lives in
+# memory only. VECTOR_ANN=hnsw builds an hnswlib index over the same matrix when
+# hnswlib is installed.
+class NumpyStore(VectorStore):
+
+    def __init__(self, path=None, ann=VECTOR_ANN):
+        self._path   = Path(path) if path else None
+        self._matrix = None
+        self._ids    = []
+        self._docs   = []
+        self._metas  = []
+        self._hnsw   = None
+        self._ann    = ann
+        self._dirty  = False
+        if self._path is not None:
+            self.manifest_path = self._path / "manifest.json"
+            self._load()
+
+    def _load(self):
+        vectors, meta = self._path / "vectors.npy", self._path / "meta.json"
+        if not (vectors.exists() and meta.exists()):
+            return
+        records = json.loads(meta.read_text(encoding="utf-8"))
+        if not records:
+            return
+        self._matrix = np.load(vectors, mmap_mode="r")
+        self._ids    = [r["id"] for r in records]
+        self._docs   = [r["text"] for r in records]
+        self._metas  = [r["metadata"] for r in records]
+
+    def add(self, ids, documents, embeddings, metadatas):
+        if not ids:
+            return
+        rows = normalise(embeddings)
+        self._matrix = rows if self._matrix is None else np.vstack([self._matrix, rows])
+        self._ids.extend(ids)
+        self._docs.extend(documents)
+        self._metas.extend(metadatas)
+        self._hnsw, self._dirty = None, True
+
+    def delete(self, ids):
+        drop = set(ids)
+        keep = [i for i, cid in enumerate(self._ids) if cid not in drop]
+        if len(keep) == len(self._ids):
+            return
+        self._matrix = np.ascontiguousarray(self._matrix[keep]) if keep else None
+        self._ids    = [self._ids[i] for i in keep]
+        self._docs   = [self._docs[i] for i in keep]
+        self._metas  = [self._metas[i] for i in keep]
+        self._hnsw, self._dirty = None, True
+
+    def ids(self):
+        return list(self._ids)
+
+    def count(self):
+        return len(self._ids)
+
+    def documents(self):
+        return list(self._ids), list(self._docs), list(self._metas)
+
+    def _build_hnsw(self):
+        try:
+            import hnswlib
+        except ImportError:
+            print("hnswlib not installed - using exact search")
+            self._ann = "exact"
+            return None
+        index = hnswlib.Index(space="ip", dim=self._matrix.shape[1])
+        index.init_index(max_elements=len(self._ids), ef_construction=200, M=16)
+        index.add_items(np.asarray(self._matrix), np.arange(len(self._ids)))
+        index.set_ef(64)
+        return index
+
+    def query(self, vector, top_k):
+        if self._matrix is None or top_k <= 0:
+            return []
+        q = normalise([vector])[0]
+        k = min(top_k, len(self._ids))
+        if self._ann == "hnsw" and self._hnsw is None:
+            self._hnsw = self._build_hnsw()
+        if self._hnsw is not None:
+            labels, dists = self._hnsw.knn_query(q, k=k)
+            top, sims = labels[0], 1.0 - dists[0]
+        else:
+            scores = self._matrix @ q
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            sims = scores[top]
+        return [
+            {"id": self._ids[i], "text": self._docs[i], "metadata": self._metas[i], "similarity": float(s)}
+            for i, s in zip(top, sims)
+        ]
+
+    def flush(self):
+        if self._path is None or not self._dirty:
+            return
+        self._path.mkdir(parents=True, exist_ok=True)
+        records = [{"id": i, "text": t, "metadata": m} for i, t, m in zip(self._ids, self._docs, self._metas)]
+        matrix  = np.asarray(self._matrix) if self._matrix is not None else np.zeros((0, 0), dtype=np.float32)
+        # Write beside the live files and swap them in, since the old matrix may be mapped
+        np.save(self._path / "vectors.tmp.npy", matrix)
+        (self._path / "meta.tmp.json").write_text(json.dumps(records), encoding="utf-8")
+        (self._path / "vectors.tmp.npy").replace(self._path / "vectors.npy")
+        (self._path / "meta.tmp.json").replace(self._path / "meta.json")
+        self._dirty = False
+
+
+def make_store(backend, embed_fn):
+    if backend == "numpy":
+        return NumpyStore(NUMPY_STORE_PATH)
+    if backend == "memory":
+        return NumpyStore()
+    if backend == "chroma":
+        return ChromaStore(embed_fn)
+    raise ValueError(f"Unknown VECTOR_BACKEND '{backend}' (expected chroma, numpy or memory)")
@@ -91,8 +91,16 @@ def get_agent():
 
 if go and query.strip():
     agent = get_agent()
-    with st.spinner("Fetching data, reasoning, and reflecting..."):
-        result = agent.run(query)
+    live = st.empty()
+    streamed = []
+
+    def show_token(text):
+        streamed.append(text)
+        live.markdown("".join(streamed))
+
+    with st.spinner("Fetching data and reasoning..."):
+        result = agent.run(query, on_token=show_token)
+    live.empty()
 
     if "history" not in st.session_state:
         st.session_state["history"] = []
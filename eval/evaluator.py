@@ -2,9 +2,18 @@
 import os
 import json
 import time
+import hashlib
+import threading
 import boto3
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from agent.config import DEMO_MODE
+from agent.reflection import ReflectionEngine
 
-REGION = os.environ.get("AWS_DEFAULT_REGION", "us-east-1")
+REGION           = os.environ.get("AWS_DEFAULT_REGION", "us-east-1")
+EVAL_WORKERS     = int(os.environ.get("EVAL_WORKERS", "4"))
+RESULTS_PATH     = os.path.join("data", "eval_results.json")
+JUDGE_CACHE_PATH = os.path.join("data", "eval_judge_cache.json")
 
 TEST_CASES = [
     {
@@ -66,10 +75,43 @@ TEST_CASES = [
 ]
 
 
+def _percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    p50, p95, p99 = np.percentile(np.asarray(values, dtype=np.float64), [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+
+# Runs every (case, repetition) on a worker pool. Judge verdicts are cached on disk by
+# (query, answer hash), and results are written after each run so an interrupted
+# suite can resume from data/eval_results.json without repeating finished runs.
 class Evaluator:
 
-    def __init__(self):
-        self.bedrock = boto3.client("bedrock-runtime", region_name=REGION)
+    def __init__(self, workers=EVAL_WORKERS, repetitions=1, results_path=RESULTS_PATH, judge_cache_path=JUDGE_CACHE_PATH):
+        self.workers          = max(1, workers)
+        self.repetitions      = max(1, repetitions)
+        self.results_path     = results_path
+        self.judge_cache_path = judge_cache_path
+        self.bedrock          = None if DEMO_MODE else boto3.client("bedrock-runtime", region_name=REGION)
+        self._lock            = threading.Lock()
+        self._judge_cache     = self._load_json(judge_cache_path, {})
+        self.judge_stats      = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _load_json(path, default):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    @staticmethod
+    def _write_json(path, data):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
 
     def _call_claude(self, prompt):
         body = {
@@ -87,94 +129,138 @@ class Evaluator:
         return result["content"][0]["text"]
 
     def _judge_quality(self, query, answer):
-        prompt = f"""Rate this Azure cost analysis answer from 0 to 10.
+        key = hashlib.sha256(f"{query}\n{hashlib.sha256(answer.encode()).hexdigest()}".encode()).hexdigest()
+        with self._lock:
+            cached = self._judge_cache.get(key)
+            self.judge_stats["hits" if cached else "misses"] += 1
+        if cached:
+            return cached
+        if self.bedrock is None:
+            # Demo mode has no Bedrock judge; score with the agent's local rubric instead
+            score, parts = ReflectionEngine(judge=None).pre_score(query, answer)
+            verdict = {"score": round(score), "reason": "Local rubric " + ", ".join(f"{k} {v}" for k, v in parts.items())}
+        else:
+            prompt = f"""Rate this Azure cost analysis answer from 0 to 10.
 Question: {query}
 Answer: {answer}
 Criteria: answers question (3pts), has dollar amounts (3pts), actionable (2pts), clear (2pts).
 Respond ONLY with JSON no markdown: {{"score":<0-10>,"reason":"<one sentence>"}}"""
-        raw = self._call_claude(prompt).strip()
-        raw = raw.replace("```json","").replace("```","").strip()
+            raw = self._call_claude(prompt).strip()
+            raw = raw.replace("```json","").replace("```","").strip()
+            try:
+                verdict = json.loads(raw)
+            except Exception:
+                return {"score": 5, "reason": "parse error"}
+        with self._lock:
+            self._judge_cache[key] = verdict
+            self._write_json(self.judge_cache_path, self._judge_cache)
+        return verdict
+
+    def _run_case(self, agent_fn, tc, rep):
+        t0 = time.time()
         try:
-            return json.loads(raw)
-        except Exception:
-            return {"score": 5, "reason": "parse error"}
+            out     = agent_fn(tc["query"])
+            latency = round(time.time() - t0, 3)
+            answer  = out.get("answer", "")
+            tool    = out.get("tool_called", "")
 
-    def run(self, agent_fn):
-        print("\n" + "="*50)
-        print("EVALUATION — 8 Azure Cost Queries")
-        print("="*50)
+            tool_correct = tool == tc["expected_tool"]
+            kw_hits      = sum(1 for kw in tc["expected_keywords"] if kw.lower() in answer.lower())
+            quality      = self._judge_quality(tc["query"], answer)
+            refl_score   = out.get("reflection", {}).get("score", 0)
 
-        results = []
-        for tc in TEST_CASES:
-            print(f"\nRunning {tc['id']} [{tc['category']}]")
-            print(f"Query: {tc['query'][:55]}...")
-            t0 = time.time()
-            try:
-                out     = agent_fn(tc["query"])
-                latency = round(time.time() - t0, 2)
-                answer  = out.get("answer", "")
-                tool    = out.get("tool_called", "")
-
-                tool_correct = tool == tc["expected_tool"]
-                kw_hits      = sum(1 for kw in tc["expected_keywords"] if kw.lower() in answer.lower())
-                quality      = self._judge_quality(tc["query"], answer)
-                refl_score   = out.get("reflection", {}).get("score", 0)
-
-                passed = (
-                    tool_correct
-                    and kw_hits / len(tc["expected_keywords"]) >= 0.4
-                    and quality["score"] >= 6
-                )
-
-                results.append({
-                    "id":            tc["id"],
-                    "category":      tc["category"],
-                    "tool_correct":  tool_correct,
-                    "kw_hits":       kw_hits,
-                    "kw_total":      len(tc["expected_keywords"]),
-                    "quality_score": quality["score"],
-                    "quality_reason":quality["reason"],
-                    "refl_score":    refl_score,
-                    "latency":       latency,
-                    "passed":        passed,
-                })
-
-                status = "PASS" if passed else "FAIL"
-                print(f"   {status} | tool={tool_correct} | kw={kw_hits}/{len(tc['expected_keywords'])} | quality={quality['score']}/10 | {latency}s")
-
-            except Exception as e:
-                print(f"   ERROR: {e}")
-                results.append({
-                    "id": tc["id"], "category": tc["category"],
-                    "tool_correct": False, "kw_hits": 0,
-                    "kw_total": len(tc["expected_keywords"]),
-                    "quality_score": 0, "quality_reason": str(e),
-                    "refl_score": 0, "latency": 0, "passed": False,
-                })
+            passed = (
+                tool_correct
+                and kw_hits / len(tc["expected_keywords"]) >= 0.4
+                and quality["score"] >= 6
+            )
+            return {
+                "id":            tc["id"],
+                "rep":           rep,
+                "category":      tc["category"],
+                "tool_correct":  tool_correct,
+                "kw_hits":       kw_hits,
+                "kw_total":      len(tc["expected_keywords"]),
+                "quality_score": quality["score"],
+                "quality_reason":quality["reason"],
+                "refl_score":    refl_score,
+                "latency":       latency,
+                "timings_ms":    out.get("timings", {}),
+                "cached":        bool(out.get("cached")),
+                "passed":        passed,
+            }
+        except Exception as e:
+            return {
+                "id": tc["id"], "rep": rep, "category": tc["category"],
+                "tool_correct": False, "kw_hits": 0,
+                "kw_total": len(tc["expected_keywords"]),
+                "quality_score": 0, "quality_reason": str(e),
+                "refl_score": 0, "latency": 0, "timings_ms": {}, "cached": False,
+                "passed": False, "error": True,
+            }
 
+    def _summary(self, results):
         total  = len(results)
         passed = sum(1 for r in results if r["passed"])
-        summary = {
+        stages = {}
+        for r in results:
+            for stage, ms in r.get("timings_ms", {}).items():
+                stages.setdefault(stage, []).append(ms)
+        return {
             "total":             total,
             "passed":            passed,
             "failed":            total - passed,
-            "pass_rate_pct":     round(passed / total * 100, 1),
-            "tool_accuracy_pct": round(sum(r["tool_correct"] for r in results) / total * 100, 1),
-            "avg_quality":       round(sum(r["quality_score"] for r in results) / total, 1),
-            "avg_latency_sec":   round(sum(r["latency"] for r in results) / total, 1),
-            "results":           results,
+            "repetitions":       self.repetitions,
+            "pass_rate_pct":     round(passed / total * 100, 1) if total else 0.0,
+            "tool_accuracy_pct": round(sum(r["tool_correct"] for r in results) / total * 100, 1) if total else 0.0,
+            "avg_quality":       round(sum(r["quality_score"] for r in results) / total, 1) if total else 0.0,
+            "avg_latency_sec":   round(sum(r["latency"] for r in results) / total, 1) if total else 0.0,
+            "latency_sec":       _percentiles([r["latency"] for r in results if not r.get("error")]),
+            "stage_timings_ms":  {stage: _percentiles(v) for stage, v in stages.items()},
+            "judge_cache":       dict(self.judge_stats),
+            "results":           sorted(results, key=lambda r: (r["id"], r.get("rep", 0))),
         }
 
+    def run(self, agent_fn, test_cases=TEST_CASES, resume=False):
+        runs = [(tc, rep) for tc in test_cases for rep in range(self.repetitions)]
+        done = {}
+        if resume:
+            for r in self._load_json(self.results_path, {}).get("results", []):
+                if not r.get("error"):
+                    done[(r["id"], r.get("rep", 0))] = r
+        pending = [(tc, rep) for tc, rep in runs if (tc["id"], rep) not in done]
+
+        print("\n" + "="*50)
+        print(f"EVALUATION — {len(test_cases)} Azure Cost Queries x {self.repetitions} ({len(pending)} to run, {len(runs) - len(pending)} resumed, {self.workers} workers)")
+        print("="*50)
+
+        results = [done[(tc["id"], rep)] for tc, rep in runs if (tc["id"], rep) in done]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._run_case, agent_fn, tc, rep): tc for tc, rep in pending}
+            for future in as_completed(futures):
+                tc, r = futures[future], future.result()
+                with self._lock:
+                    results.append(r)
+                    self._write_json(self.results_path, self._summary(results))
+                if r.get("error"):
+                    print(f"   {tc['id']}#{r['rep']} ERROR: {r['quality_reason']}")
+                else:
+                    status = "PASS" if r["passed"] else "FAIL"
+                    print(f"   {tc['id']}#{r['rep']} [{tc['category']}] {status} | tool={r['tool_correct']} | kw={r['kw_hits']}/{r['kw_total']} | quality={r['quality_score']}/10 | {r['latency']}s")
+
+        summary = self._summary(results)
         print("\n" + "="*50)
         print("SUMMARY")
         print("="*50)
-        print(f"Pass rate      : {passed}/{total} ({summary['pass_rate_pct']}%)")
+        print(f"Pass rate      : {summary['passed']}/{summary['total']} ({summary['pass_rate_pct']}%)")
         print(f"Tool accuracy  : {summary['tool_accuracy_pct']}%")
         print(f"Avg quality    : {summary['avg_quality']}/10")
-        print(f"Avg latency    : {summary['avg_latency_sec']}s")
+        lat = summary["latency_sec"]
+        print(f"Latency        : p50 {lat['p50']}s | p95 {lat['p95']}s | p99 {lat['p99']}s")
+        for stage, p in summary["stage_timings_ms"].items():
+            print(f"  {stage:<13}: p50 {p['p50']}ms | p95 {p['p95']}ms")
+        print(f"Judge cache    : {self.judge_stats['hits']} hits / {self.judge_stats['misses']} misses")
 
-        os.makedirs("data", exist_ok=True)
-        with open("data/eval_results.json", "w") as f:
-            json.dump(summary, f, indent=2)
-        print("\nSaved results to data/eval_results.json")
+        self._write_json(self.results_path, summary)
+        print(f"\nSaved results to {self.results_path}")
         return summary
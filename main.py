@@ -19,31 +19,61 @@ def interactive():
             break
         if q.lower() in ("exit", "quit", ""):
             break
-        r = agent.run(q)
         print("\n" + "="*50)
-        print(r["answer"])
-        print(f"\nScore: {r['reflection']['score']}/10 | Tool: {r['tool_called']}\n")
+        r = agent.run(q, on_token=lambda t: print(t, end="", flush=True))
+        print(f"\n\nScore: {r['reflection']['score']}/10 | Tool: {r['tool_called']}\n")
 
 def single(query):
     from agent.orchestrator import AzureCostAgent
     r = AzureCostAgent().run(query)
     print("\n" + r["answer"])
 
-def run_eval():
+def reindex(watch=False):
+    from agent.rag_retriever import RAGRetriever
+    rag = RAGRetriever()
+    if watch:
+        rag.watch()
+
+# Meant for a daily cron: only days closed since the previous run are scanned
+def scan_anomalies():
+    from tools.azure_cost import scan_resource_group_anomalies
+    r = scan_resource_group_anomalies()
+    days = r["days_scanned"]
+    span = f" ({days[0]} to {days[-1]})" if days else ""
+    print(f"Scanned {len(days)} new day(s) across {r['resource_groups_scanned']} resource groups{span}")
+    for s in r["spikes"]:
+        print(f"  {s['date']} {s['resource_group']}: ${s['cost_usd']} vs ${s['expected_usd']} expected (score {s['score']})")
+
+# Repetitions would otherwise be served from the semantic answer cache, so it is off
+# unless asked for and latency figures reflect the full pipeline
+def run_eval(workers=None, repeat=1, resume=False, answer_cache=False):
     from agent.orchestrator import AzureCostAgent
-    from eval.evaluator import Evaluator
+    from eval.evaluator import Evaluator, EVAL_WORKERS
     agent = AzureCostAgent()
-    Evaluator().run(agent.run)
+    if not answer_cache:
+        agent.answer_cache = None
+    Evaluator(workers=workers or EVAL_WORKERS, repetitions=repeat).run(agent.run, resume=resume)
 
 if __name__ == "__main__":
     check()
     p = argparse.ArgumentParser()
     p.add_argument("--query", type=str)
     p.add_argument("--eval",  action="store_true")
+    p.add_argument("--eval-workers", type=int, help="evaluation cases run in parallel (default EVAL_WORKERS)")
+    p.add_argument("--eval-repeat",  type=int, default=1, help="runs per evaluation case, for latency percentiles")
+    p.add_argument("--eval-resume",  action="store_true", help="skip runs already recorded in data/eval_results.json")
+    p.add_argument("--eval-answer-cache", action="store_true", help="let evaluation runs hit the semantic answer cache")
+    p.add_argument("--reindex", action="store_true", help="sync the knowledge base with runbooks/ and exit")
+    p.add_argument("--watch",   action="store_true", help="keep the knowledge base in sync while runbooks/ changes")
+    p.add_argument("--scan-anomalies", action="store_true", help="feed new closed days to the saved resource-group anomaly engine and exit")
     args = p.parse_args()
 
-    if args.eval:
-        run_eval()
+    if args.reindex or args.watch:
+        reindex(watch=args.watch)
+    elif args.scan_anomalies:
+        scan_anomalies()
+    elif args.eval:
+        run_eval(args.eval_workers, args.eval_repeat, args.eval_resume, args.eval_answer_cache)
     elif args.query:
         single(args.query)
     else:
@@ -0,0 +1,118 @@
+import datetime
+import numpy as np
+
+
+# Maps each value to a dense integer code in first-seen order
+def factorize(values):
+    lookup = {}
+    codes  = np.fromiter((lookup.setdefault(v, len(lookup)) for v in values), dtype=np.int64, count=len(values))
+    return codes, list(lookup)
+
+
+def group_sum(codes, costs, n_groups):
+    return np.bincount(codes, weights=costs, minlength=n_groups)
+
+
+def top_n(totals, n=None):
+    order = np.argsort(-totals, kind="stable")
+    return order if n is None else order[:n]
+
+
+def percent_of_total(totals):
+    total = totals.sum()
+    return totals / total * 100 if total else np.zeros_like(totals)
+
+
+# Sum of the last `days` days against the `days` before them
+def period_over_period(day_costs, days=7):
+    current  = float(day_costs[-days:].sum())
+    previous = float(day_costs[-2 * days:-days].sum()) if len(day_costs) >= 2 * days else 0.0
+    delta = current - previous
+    return {
+        "days":         days,
+        "current_usd":  round(current, 2),
+        "previous_usd": round(previous, 2),
+        "delta_usd":    round(delta, 2),
+        "delta_pct":    round(delta / previous * 100, 1) if previous else None,
+    }
+
+
+# Projects month-end spend from the days seen so far this month. With two weeks of
+# history the linear trend is scaled by a day-of-week profile; otherwise it is a
+# plain least-squares line over the series.
+def forecast_month_end(days, day_costs, today=None):
+    if len(days) == 0:
+        return None
+    today  = today or days[-1].astype(object)
+    start  = np.datetime64(today.replace(day=1), "D")
+    end    = np.datetime64((today.replace(day=28) + datetime.timedelta(days=4)).replace(day=1), "D")
+    mtd    = float(day_costs[days >= start].sum())
+    remain = np.arange(days[-1] + 1, end, dtype="datetime64[D]")
+    x = (days - days[0]).astype(np.float64)
+    if len(x) >= 2:
+        slope, intercept = np.polyfit(x, day_costs, 1)
+    else:
+        slope, intercept = 0.0, float(day_costs[0])
+    fx = (remain - days[0]).astype(np.float64)
+    projected = np.maximum(intercept + slope * fx, 0.0)
+    method = "linear"
+    if len(days) >= 14:
+        dow     = (days.astype("datetime64[D]").view("int64") + 3) % 7
+        fitted  = intercept + slope * x
+        ratio   = np.divide(day_costs, fitted, out=np.ones_like(day_costs), where=fitted > 0)
+        profile = np.bincount(dow, weights=ratio, minlength=7) / np.maximum(np.bincount(dow, minlength=7), 1)
+        profile[profile == 0] = 1.0
+        projected = projected * profile[(remain.view("int64") + 3) % 7]
+        method = "linear_weekday"
+    return {
+        "month_to_date_usd": round(mtd, 2),
+        "forecast_usd":      round(mtd + float(projected.sum()), 2),
+        "days_remaining":    int(len(remain)),
+        "method":            method,
+    }
+
+
+# Cost rows as NumPy columns: float64 cost plus integer codes for date, service and
+# resource group. Each code column is factorised on first use, so a view pays only for
+# the column it groups by; every view is then a bincount.
+class CostFrame:
+
+    def __init__(self, date, service, resource_group, cost):
+        self._columns = {"date": date, "service": service, "resource_group": resource_group}
+        self._codes   = {}
+        self.cost     = np.asarray(cost, dtype=np.float64)
+
+    def codes(self, column):
+        if column not in self._codes:
+            self._codes[column] = factorize(self._columns[column])
+        return self._codes[column]
+
+    def total(self):
+        return float(self.cost.sum())
+
+    def _grouped(self, column, n=None):
+        codes, labels = self.codes(column)
+        totals = group_sum(codes, self.cost, len(labels))
+        pct    = percent_of_total(totals)
+        return [
+            {column: labels[i], "cost_usd": round(float(totals[i]), 2), "pct_of_total": round(float(pct[i]), 1)}
+            for i in top_n(totals, n)
+        ]
+
+    def by_service(self, n=None):
+        return self._grouped("service", n)
+
+    def by_resource_group(self, n=None):
+        return self._grouped("resource_group", n)
+
+    # (days, cost per day) over the dates present, in calendar order
+    def daily_series(self):
+        codes, labels = self.codes("date")
+        days   = np.array(labels, dtype="datetime64[D]") if labels else np.array([], dtype="datetime64[D]")
+        totals = group_sum(codes, self.cost, len(labels))
+        order  = np.argsort(days)
+        return days[order], totals[order]
+
+    def daily(self):
+        days, totals = self.daily_series()
+        return [{"date": str(d), "cost_usd": round(float(c), 2)} for d, c in zip(days, totals)]
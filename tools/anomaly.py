@@ -0,0 +1,183 @@
+import os
+import datetime
+import numpy as np
+
+WINDOW         = int(os.environ.get("ANOMALY_WINDOW_DAYS", "28"))
+MIN_HISTORY    = int(os.environ.get("ANOMALY_MIN_HISTORY", "5"))
+MIN_SEASONAL   = int(os.environ.get("ANOMALY_MIN_SEASONAL", "3"))
+THRESHOLD      = float(os.environ.get("ANOMALY_THRESHOLD", "3.5"))
+MIN_DELTA_USD  = float(os.environ.get("ANOMALY_MIN_DELTA_USD", "1.0"))
+HISTORY_DAYS   = int(os.environ.get("ANOMALY_HISTORY_DAYS", "90"))
+STATE_PATH     = os.environ.get("ANOMALY_STATE_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "anomaly_state.npz"))
+MAD_TO_STD     = 1.4826
+
+
+# Online mean/variance for many series at once; each update is O(1) per series
+class Welford:
+
+    def __init__(self, shape):
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean  = np.zeros(shape, dtype=np.float64)
+        self.m2    = np.zeros(shape, dtype=np.float64)
+
+    def update(self, values, mask=None):
+        mask = np.ones(values.shape, dtype=bool) if mask is None else mask
+        self.count[mask] += 1
+        delta = np.where(mask, values - self.mean, 0.0)
+        self.mean += np.where(mask, delta / np.maximum(self.count, 1), 0.0)
+        self.m2   += np.where(mask, delta * (values - self.mean), 0.0)
+
+    # Appends n series with no observations
+    def grow(self, n):
+        shape = (n,) + self.count.shape[1:]
+        self.count = np.concatenate([self.count, np.zeros(shape, dtype=np.int64)])
+        self.mean  = np.concatenate([self.mean, np.zeros(shape)])
+        self.m2    = np.concatenate([self.m2, np.zeros(shape)])
+
+    def std(self):
+        return np.sqrt(np.where(self.count > 0, self.m2 / np.maximum(self.count, 1), 0.0))
+
+
+# Scores each new day of N series against three baselines and then absorbs it:
+#   - rolling window of the last WINDOW days, scored robustly with median/MAD
+#   - same-weekday history (Welford per weekday) once MIN_SEASONAL weeks exist
+#   - all-time Welford mean/std, reported for context
+# A day is anomalous when it clears THRESHOLD robust deviations on the rolling
+# baseline and, where seasonal history exists, on the weekday baseline too, so a
+# regular Monday peak is not a spike. Flagged values are clipped to the threshold
+# before entering the baselines so one spike does not mask the next. Each series
+# needs min_history days of its own before it can be flagged, so one added later
+# (its buffer starts empty) is scored only once it has a baseline.
+class AnomalyEngine:
+
+    def __init__(self, keys, window=WINDOW, threshold=THRESHOLD, min_history=MIN_HISTORY):
+        self.keys        = list(keys)
+        self.window      = window
+        self.threshold   = threshold
+        self.min_history = min_history
+        n = len(self.keys)
+        self.buffer      = np.full((n, window), np.nan)
+        self.filled      = 0
+        self.overall     = Welford(n)
+        self.weekday     = Welford((n, 7))
+        self.last_date   = None
+
+    def _scale(self, centre, spread):
+        return np.maximum.reduce([spread, 0.05 * np.abs(centre), np.full(centre.shape, MIN_DELTA_USD)])
+
+    def add_series(self, keys):
+        known = set(self.keys)
+        keys  = [k for k in dict.fromkeys(keys) if k not in known]
+        if not keys:
+            return
+        self.keys.extend(keys)
+        self.buffer = np.vstack([self.buffer, np.full((len(keys), self.window), np.nan)])
+        self.overall.grow(len(keys))
+        self.weekday.grow(len(keys))
+
+    def update(self, date, values):
+        values  = np.asarray(values, dtype=np.float64)
+        dow     = datetime.date.fromisoformat(date).weekday()
+        history = self.buffer[:, :min(self.filled, self.window)]
+
+        ready   = np.sum(~np.isnan(history), axis=1) >= self.min_history
+        median  = np.zeros_like(values)
+        mad     = np.zeros_like(values)
+        if ready.any():
+            median[ready] = np.nanmedian(history[ready], axis=1)
+            mad[ready]    = np.nanmedian(np.abs(history[ready] - median[ready, None]), axis=1)
+        scale    = np.where(ready, self._scale(median, MAD_TO_STD * mad), np.inf)
+        rolling  = np.where(ready, (values - median) / scale, 0.0)
+        expected = np.where(ready, median, values)
+
+        seasonal_ready = self.weekday.count[:, dow] >= MIN_SEASONAL
+        w_mean   = self.weekday.mean[:, dow]
+        w_std    = self.weekday.std()[:, dow]
+        seasonal = np.where(seasonal_ready, (values - w_mean) / self._scale(w_mean, w_std), np.inf)
+        score    = np.minimum(rolling, seasonal)
+        flagged  = (score > self.threshold) & (values - expected >= MIN_DELTA_USD)
+        limit    = expected + self.threshold * scale
+
+        absorbed = np.where(flagged, np.minimum(values, limit), values)
+        self.buffer[:, self.filled % self.window] = absorbed
+        self.filled += 1
+        self.overall.update(absorbed)
+        weekday_mask = np.zeros(self.weekday.count.shape, dtype=bool)
+        weekday_mask[:, dow] = True
+        self.weekday.update(np.repeat(absorbed[:, None], 7, axis=1), mask=weekday_mask)
+        self.last_date = date
+        return {"score": score, "flagged": flagged, "expected": expected, "limit": limit}
+
+    # matrix is (series, days); returns (series, days) arrays of score, flag, expected
+    def scan(self, dates, matrix):
+        matrix = np.asarray(matrix, dtype=np.float64)
+        out = {k: np.zeros(matrix.shape, dtype=bool if k == "flagged" else np.float64) for k in ("score", "flagged", "expected", "limit")}
+        for t, date in enumerate(dates):
+            step = self.update(date, matrix[:, t])
+            for k in out:
+                out[k][:, t] = step[k]
+        return out
+
+    def save(self, path):
+        np.savez(
+            path, keys=np.array(self.keys), buffer=self.buffer, filled=self.filled,
+            count=self.overall.count, mean=self.overall.mean, m2=self.overall.m2,
+            w_count=self.weekday.count, w_mean=self.weekday.mean, w_m2=self.weekday.m2,
+            last_date=np.array(self.last_date or ""),
+        )
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        data   = np.load(path)
+        engine = cls(data["keys"].tolist(), window=data["buffer"].shape[1], **kwargs)
+        engine.buffer = data["buffer"]
+        engine.filled = int(data["filled"])
+        engine.overall.count, engine.overall.mean, engine.overall.m2 = data["count"], data["mean"], data["m2"]
+        engine.weekday.count, engine.weekday.mean, engine.weekday.m2 = data["w_count"], data["w_mean"], data["w_m2"]
+        engine.last_date = str(data["last_date"]) or None
+        return engine
+
+
+# Pivots (key, date, cost) columns into a dense (keys, days) matrix over every
+# calendar day in range, so missing days count as zero spend.
+def pivot_daily(keys, dates, costs):
+    if not dates:
+        return [], [], np.zeros((0, 0))
+    first, last = datetime.date.fromisoformat(min(dates)), datetime.date.fromisoformat(max(dates))
+    days = [(first + datetime.timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+    names, key_idx = np.unique(np.asarray(keys, dtype=object).astype(str), return_inverse=True)
+    day_idx = np.searchsorted(np.asarray(days), np.asarray(dates))
+    matrix  = np.zeros((len(names), len(days)))
+    np.add.at(matrix, (key_idx, day_idx), np.asarray(costs, dtype=np.float64))
+    return names.tolist(), days, matrix
+
+
+# Last day the engine saved at state_path has absorbed, without loading its arrays
+def saved_last_date(state_path):
+    if not os.path.exists(state_path):
+        return None
+    with np.load(state_path) as data:
+        return str(data["last_date"]) or None
+
+
+# Daily-job entry point: restores the saved engine and feeds it only the days after
+# its last_date, so each run costs O(series) however long the history is. Series
+# the engine knows but the input lacks count as zero spend; series it has never seen
+# are added with empty baselines. Returns (keys, days scanned, scan).
+def scan_incremental(state_path, keys, days, matrix):
+    engine, start = None, 0
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if os.path.exists(state_path):
+        engine = AnomalyEngine.load(state_path)
+        engine.add_series(keys)
+        row     = {k: i for i, k in enumerate(engine.keys)}
+        aligned = np.zeros((len(engine.keys), matrix.shape[1]))
+        aligned[[row[k] for k in keys]] = matrix
+        keys, matrix = engine.keys, aligned
+        start = next((i for i, d in enumerate(days) if d > (engine.last_date or "")), len(days))
+    if engine is None:
+        engine = AnomalyEngine(keys)
+    result = engine.scan(days[start:], matrix[:, start:])
+    os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    engine.save(state_path)
+    return list(keys), days[start:], result
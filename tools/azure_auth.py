@@ -0,0 +1,112 @@
+import os, time, threading
+from tools import http_client
+
+AAD_SCOPE            = "https://management.azure.com/.default"
+REFRESH_MARGIN_SEC   = int(os.environ.get("AZURE_TOKEN_REFRESH_MARGIN_SEC", "300"))
+EXPIRY_SKEW_SEC      = 30
+REFRESH_BACKOFF_SEC  = 30
+FLIGHT_WAIT_SEC      = 20
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done  = threading.Event()
+        self.error = None
+
+
+# Keyed by (tenant, client, scope). Inside the refresh margin the cached token is
+# still served while one background thread renews it; concurrent misses share one fetch.
+class TokenCache:
+
+    def __init__(self, refresh_margin=REFRESH_MARGIN_SEC):
+        self.refresh_margin = refresh_margin
+        self._lock          = threading.Lock()
+        self._tokens        = {}
+        self._inflight      = {}
+        self._next_refresh  = {}
+        self._stats         = {"hits": 0, "misses": 0, "fetches": 0, "background_refreshes": 0, "errors": 0}
+
+    def get(self, tenant_id, client_id, client_secret, scope=AAD_SCOPE):
+        key = (tenant_id, client_id, scope)
+        now = time.time()
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry and now < entry[1]:
+                self._stats["hits"] += 1
+                if entry[1] - now < self.refresh_margin:
+                    self._maybe_refresh_in_background(key, client_secret, now)
+                return entry[0]
+            self._stats["misses"] += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+        if leader:
+            self._refresh(key, client_secret, flight)
+        else:
+            flight.done.wait(FLIGHT_WAIT_SEC)
+        if flight.error is not None:
+            raise flight.error
+        with self._lock:
+            entry = self._tokens.get(key)
+        if entry is None:
+            raise RuntimeError("Timed out waiting for Azure AD token refresh")
+        return entry[0]
+
+    def _maybe_refresh_in_background(self, key, client_secret, now):
+        # Caller holds self._lock
+        if key in self._inflight or now < self._next_refresh.get(key, 0):
+            return
+        flight = self._inflight[key] = _Flight()
+        self._stats["background_refreshes"] += 1
+        threading.Thread(target=self._refresh, args=(key, client_secret, flight), daemon=True).start()
+
+    def _refresh(self, key, client_secret, flight):
+        tenant_id, client_id, scope = key
+        try:
+            token, expires_in = _fetch_token(tenant_id, client_id, client_secret, scope)
+            with self._lock:
+                self._stats["fetches"] += 1
+                self._tokens[key] = (token, time.time() + max(expires_in - EXPIRY_SKEW_SEC, 0))
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+                self._next_refresh[key] = time.time() + REFRESH_BACKOFF_SEC
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._next_refresh.clear()
+
+
+def _fetch_token(tenant_id, client_id, client_secret, scope):
+    url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
+    payload = {
+        "grant_type": "client_credentials",
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "scope": scope,
+    }
+    resp = http_client.post(url, data=payload, timeout=15)
+    data = resp.json()
+    return data["access_token"], int(data.get("expires_in", 3599))
+
+
+TOKEN_CACHE = TokenCache()
+
+
+def token_cache_stats():
+    return TOKEN_CACHE.stats()
@@ -1,6 +1,20 @@
 
-import os, json, datetime, requests
+import os, json, datetime, threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
+from tools import http_client
+from tools.azure_auth import TOKEN_CACHE
+from tools.cost_table import CostTable
+from tools.query_cache import QUERY_CACHE
+from tools.rate_limit import tenant_limiter
+from tools.cost_warehouse import WAREHOUSE
+from tools.anomaly import AnomalyEngine, pivot_daily, scan_incremental, saved_last_date, HISTORY_DAYS, STATE_PATH
+from tools.analytics import percent_of_total, period_over_period, forecast_month_end
+from tools.optimiser import rule_index
+from agent.secure_logger import get_logger
+
+logger = get_logger("azure_cost")
 
 def _get_token():
     tenant_id = os.environ.get("AZURE_TENANT_ID")
@@ -8,51 +22,251 @@ def _get_token():
     client_secret = os.environ.get("AZURE_CLIENT_SECRET")
     if not all([tenant_id, client_id, client_secret]):
         return None
-    url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-    payload = {
-        "grant_type": "client_credentials",
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "scope": "https://management.azure.com/.default",
+    return TOKEN_CACHE.get(tenant_id, client_id, client_secret)
+
+def _window(days=30, from_date=None, to_date=None):
+    to_date = to_date or datetime.date.today().isoformat()
+    from_date = from_date or (datetime.date.fromisoformat(to_date) - datetime.timedelta(days=days)).isoformat()
+    return from_date, to_date
+
+# All tool views are derived from one Daily query grouped by service and resource
+# group, so a question that needs several views costs a single Cost Management call.
+PLAN_GROUPING = ("ServiceName", "ResourceGroupName")
+_plan_lock    = threading.Lock()
+_plan_flights = {}
+
+MAX_PAGES = int(os.environ.get("COST_QUERY_MAX_PAGES", "500"))
+RESOURCE_TAG_KEYS = [k.strip() for k in os.environ.get("COST_RESOURCE_TAG_KEYS", "environment,env").split(",") if k.strip()]
+
+# Yields (columns, rows) one page at a time, following properties.nextLink, so only a
+# single page of raw JSON is held in memory however many rows the scope returns.
+# Returns True when MAX_PAGES stopped it with a nextLink still outstanding. A grouping
+# entry is a Dimension name or a (type, name) pair such as ("TagKey", "environment").
+def _iter_cost_pages(scope, token, from_date, to_date, granularity="None", grouping=()):
+    url = f"https://management.azure.com/{scope}/providers/Microsoft.CostManagement/query?api-version=2023-03-01"
+    body = {
+        "type": "ActualCost",
+        "timeframe": "Custom",
+        "timePeriod": {"from": from_date, "to": to_date},
+        "dataset": {"granularity": granularity, "aggregation": {"totalCost": {"name": "Cost", "function": "Sum"}}},
     }
-    resp = requests.post(url, data=payload, timeout=15)
-    resp.raise_for_status()
-    return resp.json()["access_token"]
+    if grouping:
+        body["dataset"]["grouping"] = [{"type": "Dimension", "name": g} if isinstance(g, str) else {"type": g[0], "name": g[1]} for g in grouping]
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    limiter = tenant_limiter()
+    pages = 0
+    while url and pages < MAX_PAGES:
+        resp = http_client.post(url, json=body, headers=headers, timeout=20, before_send=limiter.acquire)
+        props = resp.json()["properties"]
+        pages += 1
+        yield [c["name"] for c in props["columns"]], props["rows"]
+        url = props.get("nextLink")
+    if url:
+        logger.warning(f"Cost query for {scope} ({from_date} to {to_date}) stopped at COST_QUERY_MAX_PAGES={MAX_PAGES}; results are truncated")
+        return True
+    return False
+
+def subscription_scope(sub_id):
+    return f"subscriptions/{sub_id}"
+
+def management_group_scope(group_id):
+    return f"providers/Microsoft.Management/managementGroups/{group_id}"
 
-def get_cost_by_service(subscription_id=None):
+def _fetch_cost_table(scope, token, from_date, to_date):
+    table = CostTable()
+    pages = _iter_cost_pages(scope, token, from_date, to_date, granularity="Daily", grouping=PLAN_GROUPING)
+    while True:
+        try:
+            columns, rows = next(pages)
+        except StopIteration as done:
+            table.truncated = bool(done.value)
+            table.digest    = table.compute_digest()
+            return table
+        table.extend(columns, rows)
+
+# Undated totals for one grouping as [cost, value, ...] rows in grouping order (a
+# TagKey grouping yields the tag's value), cached like the daily table
+def _fetch_grouped(scope, token, from_date, to_date, grouping):
+    key = QUERY_CACHE.make_key(scope, grouping, "None", from_date, to_date)
+    cached = QUERY_CACHE.get(key)
+    if cached is not None:
+        return cached
+    wanted = ["Cost"] + [g if isinstance(g, str) else "TagValue" for g in grouping]
+    rows = []
+    pages = _iter_cost_pages(scope, token, from_date, to_date, grouping=grouping)
+    while True:
+        try:
+            columns, page = next(pages)
+        except StopIteration as done:
+            truncated = bool(done.value)
+            break
+        idx = [columns.index(w) if w in columns else None for w in wanted]
+        rows.extend([[row[i] if i is not None else None for i in idx] for row in page])
+    result = {"rows": rows, "truncated": truncated}
+    QUERY_CACHE.put(key, result, QUERY_CACHE.ttl_for(to_date))
+    return result
+
+def _resource_group_of(resource_id):
+    parts = resource_id.split("/")
+    lowered = [p.lower() for p in parts]
+    return parts[lowered.index("resourcegroups") + 1] if "resourcegroups" in lowered[:-1] else "Unknown"
+
+# Cost Management allows two groupings per query, so resource rows are joined from
+# ResourceId x MeterCategory (one row per resource and meter category, which carries
+# the cost), ResourceId x ServiceName and one ResourceId x TagKey query per key in
+# COST_RESOURCE_TAG_KEYS. Utilisation metrics are not part of Cost Management; rules
+# that need them apply only to rows a caller has enriched with those fields.
+def get_resource_costs(subscription_id=None, from_date=None, to_date=None):
     sub_id = subscription_id or os.environ.get("AZURE_SUBSCRIPTION_ID", "")
     token = _get_token()
+    if not (token and sub_id):
+        return _mock_resource_costs(from_date, to_date)
+    from_date, to_date = _window(from_date=from_date, to_date=to_date)
+    scope = subscription_scope(sub_id)
+    queries = [("ResourceId", "MeterCategory"), ("ResourceId", "ServiceName")] + [("ResourceId", ("TagKey", k)) for k in RESOURCE_TAG_KEYS]
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        meters, services, *tags = pool.map(lambda g: _fetch_grouped(scope, token, from_date, to_date, g), queries)
+    service_of = {}
+    for cost, rid, service in services["rows"]:
+        rid = (rid or "").lower()
+        if service and float(cost or 0) > service_of.get(rid, ("", -1.0))[1]:
+            service_of[rid] = (service, float(cost or 0))
+    tags_of = {}
+    for key, result in zip(RESOURCE_TAG_KEYS, tags):
+        for _, rid, value in result["rows"]:
+            if value:
+                tags_of.setdefault((rid or "").lower(), {})[key] = value
+    resources = []
+    for cost, rid, meter in meters["rows"]:
+        key = (rid or "").lower()
+        resources.append({
+            "resource_id":    rid or "Unknown",
+            "resource_group": _resource_group_of(rid or ""),
+            "service":        service_of.get(key, (meter or "Unknown",))[0],
+            "meter_category": meter or "Unknown",
+            "tags":           tags_of.get(key, {}),
+            "cost_usd":       round(float(cost or 0), 2),
+        })
+    result = {
+        "source": "azure_api", "period": f"{from_date} to {to_date}",
+        "total_usd": round(sum(r["cost_usd"] for r in resources), 2),
+        "resource_count": len({r["resource_id"] for r in resources}), "resources": resources,
+    }
+    if any(q["truncated"] for q in [meters, services, *tags]):
+        result["truncated"] = True
+    return result
+
+def _mock_resource_costs(from_date=None, to_date=None):
+    from_date, to_date, scale = _mock_window(from_date, to_date)
+    rng = np.random.default_rng(11)
+    meter = {"Azure Kubernetes Service": "Virtual Machines", "Azure SQL Database": "SQL Database", "Azure Blob Storage": "Storage", "Azure Monitor": "Log Analytics"}
+    resources = []
+    for svc in _mock_cost_by_service(from_date, to_date)["services"]:
+        n = 4 if svc["cost_usd"] > 100 * scale else 1
+        # Production carries the largest shares, as it would in a real subscription
+        for i, share in enumerate(sorted(rng.dirichlet(np.ones(n)), reverse=True)):
+            env = ("prod", "prod", "staging", "dev")[i]
+            row = {
+                "resource_id":    f"/subscriptions/demo/resourceGroups/rg-{env}/providers/{svc['service'].replace(' ', '')}/res-{i}",
+                "resource_group": f"rg-{env}",
+                "service":        svc["service"],
+                "meter_category": meter.get(svc["service"], svc["service"].removeprefix("Azure ")),
+                "tags":           {"environment": env},
+                "cost_usd":       round(svc["cost_usd"] * float(share), 2),
+            }
+            if svc["service"] == "Virtual Machines":
+                row["cpu_avg_pct"] = round(float(rng.uniform(5, 70)), 1)
+            resources.append(row)
+    return {
+        "source": "mock", "period": f"{from_date} to {to_date}", "total_usd": round(sum(r["cost_usd"] for r in resources), 2),
+        "resource_count": len(resources), "resources": resources,
+    }
+
+# Marks a tool result built from a table the page limit cut short
+def _flag_truncated(result, table):
+    if table.truncated:
+        result["truncated"] = True
+    return result
+
+def _sync_warehouse(scope, token, from_date, to_date):
+    WAREHOUSE.ensure(scope, from_date, to_date, lambda f, t: _fetch_cost_table(scope, token, f, t))
+
+# With COST_WAREHOUSE=true the table is read from the local warehouse, which pulls
+# only the days it is missing; otherwise the whole window is queried (and cached).
+def _load_cost_table(scope, token, from_date, to_date):
+    if WAREHOUSE is not None:
+        _sync_warehouse(scope, token, from_date, to_date)
+        return WAREHOUSE.load(scope, from_date, to_date)
+    key = QUERY_CACHE.make_key(scope, PLAN_GROUPING, "Daily", from_date, to_date)
+    cached = QUERY_CACHE.get(key)
+    if cached is not None:
+        return CostTable.from_dict(cached)
+    with _plan_lock:
+        flight = _plan_flights.setdefault(key, threading.Lock())
+    try:
+        with flight:
+            cached = QUERY_CACHE.get(key)
+            if cached is not None:
+                return CostTable.from_dict(cached)
+            table = _fetch_cost_table(scope, token, from_date, to_date)
+            QUERY_CACHE.put(key, table.to_dict(), QUERY_CACHE.ttl_for(to_date))
+            return table
+    finally:
+        with _plan_lock:
+            _plan_flights.pop(key, None)
+
+# Changes whenever the cost rows behind the default 30-day window change. The digest
+# is computed once per fetch and cached with the table (the warehouse uses its sync
+# version instead), so checking it on every question costs no hashing.
+def cost_data_fingerprint(subscription_id=None):
+    sub_id = subscription_id or os.environ.get("AZURE_SUBSCRIPTION_ID", "")
+    token = _get_token()
+    from_date, to_date = _window()
     if token and sub_id:
-        today = datetime.date.today()
-        from_date = (today - datetime.timedelta(days=30)).isoformat()
-        to_date = today.isoformat()
-        url = f"https://management.azure.com/subscriptions/{sub_id}/providers/Microsoft.CostManagement/query?api-version=2023-03-01"
-        body = {
-            "type": "ActualCost",
-            "timeframe": "Custom",
-            "timePeriod": {"from": from_date, "to": to_date},
-            "dataset": {
-                "granularity": "None",
-                "aggregation": {"totalCost": {"name": "Cost", "function": "Sum"}},
-                "grouping": [{"type": "Dimension", "name": "ServiceName"}],
-            },
-        }
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        resp = requests.post(url, json=body, headers=headers, timeout=20)
-        resp.raise_for_status()
-        raw = resp.json()
-        columns = [c["name"] for c in raw["properties"]["columns"]]
-        services = []
-        for row in raw["properties"]["rows"]:
-            record = dict(zip(columns, row))
-            services.append({"service": record.get("ServiceName", "Unknown"), "cost_usd": round(float(record.get("Cost", 0)), 2)})
-        services.sort(key=lambda x: x["cost_usd"], reverse=True)
-        return {"source": "azure_api", "period": f"{from_date} to {to_date}", "total_usd": round(sum(s["cost_usd"] for s in services), 2), "services": services[:15]}
-    return _mock_cost_by_service()
-
-def _mock_cost_by_service():
-    today = datetime.date.today()
-    from_date = (today - datetime.timedelta(days=30)).isoformat()
+        scope = subscription_scope(sub_id)
+        if WAREHOUSE is not None:
+            _sync_warehouse(scope, token, from_date, to_date)
+            digest = WAREHOUSE.version(scope)
+        else:
+            table = _load_cost_table(scope, token, from_date, to_date)
+            digest = table.digest or table.compute_digest()
+        return f"{sub_id}:{from_date}:{to_date}:{digest}"
+    return f"mock:{from_date}:{to_date}"
+
+# Single-subscription results name the subscription and window they cover, so a
+# follow-up tool (suggest_optimisations) can query the same scope; demo data has none.
+def _scope_fields(sub_id, from_date, to_date):
+    fields = {"subscription_id": sub_id} if sub_id else {}
+    return dict(fields, from_date=from_date, to_date=to_date)
+
+def get_cost_by_service(subscription_id=None, from_date=None, to_date=None):
+    sub_id = subscription_id or os.environ.get("AZURE_SUBSCRIPTION_ID", "")
+    token = _get_token()
+    if token and sub_id:
+        from_date, to_date = _window(from_date=from_date, to_date=to_date)
+        table = _load_cost_table(subscription_scope(sub_id), token, from_date, to_date)
+        services = table.by_service()
+        return _flag_truncated({"source": "azure_api", "period": f"{from_date} to {to_date}", **_scope_fields(sub_id, from_date, to_date), "total_usd": table.total(), "service_count": len(services), "services": services[:15]}, table)
+    return _mock_cost_by_service(from_date, to_date)
+
+def _with_pct(rows):
+    pct = percent_of_total(np.array([r["cost_usd"] for r in rows], dtype=np.float64))
+    return [dict(r, pct_of_total=round(float(p), 1)) for r, p in zip(rows, pct)]
+
+# Demo data honours a requested window: the period echoes it and the 30-day totals
+# are scaled to its length
+def _mock_window(from_date=None, to_date=None):
+    from_date, to_date = _window(from_date=from_date, to_date=to_date)
+    if from_date > to_date:
+        raise ValueError(f"from_date {from_date} is after to_date {to_date}")
+    scale = max((datetime.date.fromisoformat(to_date) - datetime.date.fromisoformat(from_date)).days, 1) / 30
+    return from_date, to_date, scale
+
+def _scaled(rows, scale):
+    return [dict(r, cost_usd=round(r["cost_usd"] * scale, 2)) for r in rows]
+
+def _mock_cost_by_service(from_date=None, to_date=None):
+    from_date, to_date, scale = _mock_window(from_date, to_date)
     services = [
         {"service": "Azure Kubernetes Service", "cost_usd": 1420.50},
         {"service": "Virtual Machines", "cost_usd": 980.30},
@@ -65,87 +279,155 @@ def _mock_cost_by_service():
         {"service": "Azure Container Registry", "cost_usd": 38.10},
         {"service": "Azure Virtual Network", "cost_usd": 21.50},
     ]
-    return {"source": "mock", "period": f"{from_date} to {today.isoformat()}", "total_usd": round(sum(s["cost_usd"] for s in services), 2), "services": services}
+    services = _scaled(services, scale)
+    return {"source": "mock", "period": f"{from_date} to {to_date}", **_scope_fields(None, from_date, to_date), "total_usd": round(sum(s["cost_usd"] for s in services), 2), "service_count": len(services), "services": _with_pct(services)}
 
-def get_daily_cost_trend(subscription_id=None):
+def get_daily_cost_trend(subscription_id=None, from_date=None, to_date=None):
     sub_id = subscription_id or os.environ.get("AZURE_SUBSCRIPTION_ID", "")
     token = _get_token()
     if token and sub_id:
-        today = datetime.date.today()
-        from_date = (today - datetime.timedelta(days=30)).isoformat()
-        to_date = today.isoformat()
-        url = f"https://management.azure.com/subscriptions/{sub_id}/providers/Microsoft.CostManagement/query?api-version=2023-03-01"
-        body = {
-            "type": "ActualCost",
-            "timeframe": "Custom",
-            "timePeriod": {"from": from_date, "to": to_date},
-            "dataset": {"granularity": "Daily", "aggregation": {"totalCost": {"name": "Cost", "function": "Sum"}}},
-        }
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        resp = requests.post(url, json=body, headers=headers, timeout=20)
-        resp.raise_for_status()
-        raw = resp.json()
-        cols = [c["name"] for c in raw["properties"]["columns"]]
-        daily = []
-        for row in raw["properties"]["rows"]:
-            rec = dict(zip(cols, row))
-            daily.append({"date": str(rec.get("UsageDate", ""))[:10], "cost_usd": round(float(rec.get("Cost", 0)), 2)})
-    else:
-        daily = _mock_daily_trend()
-    return _annotate_anomalies(daily)
+        from_date, to_date = _window(from_date=from_date, to_date=to_date)
+        table = _load_cost_table(subscription_scope(sub_id), token, from_date, to_date)
+        return _flag_truncated(_annotate_anomalies(table.daily(), source="azure_api"), table)
+    return _annotate_anomalies(_mock_daily_trend(from_date, to_date), source="mock")
 
-def _mock_daily_trend():
+# The last 30 days by default. For an explicit window each day is derived from its
+# offset to the default start, with noise seeded by the date, so any window shows
+# the same value for a given day.
+def _mock_daily_trend(from_date=None, to_date=None):
     import random, math
-    random.seed(42)
     today = datetime.date.today()
+    anchor = today - datetime.timedelta(days=29)
+    if from_date is None and to_date is None:
+        random.seed(42)
+        days = [(i, anchor + datetime.timedelta(days=i), random) for i in range(30)]
+    else:
+        from_date, to_date, _ = _mock_window(from_date, to_date)
+        first, last = datetime.date.fromisoformat(from_date), datetime.date.fromisoformat(to_date)
+        days = [
+            ((day - anchor).days, day, random.Random(day.toordinal()))
+            for day in (first + datetime.timedelta(days=n) for n in range((last - first).days + 1))
+        ]
     daily = []
-    for i in range(30):
-        day = today - datetime.timedelta(days=29 - i)
+    for i, day, rng in days:
         base = 130 + 20 * math.sin(i / 7)
         spike = 280 if i in (7, 21) else 0
-        cost = round(base + random.uniform(-10, 10) + spike, 2)
+        cost = round(base + rng.uniform(-10, 10) + spike, 2)
         daily.append({"date": day.isoformat(), "cost_usd": cost})
     return daily
 
-def _annotate_anomalies(daily):
-    costs = [d["cost_usd"] for d in daily]
-    mean = sum(costs) / len(costs)
-    variance = sum((c - mean) ** 2 for c in costs) / len(costs)
-    std = variance ** 0.5
-    threshold = mean + 1.5 * std
-    anomalies = []
-    for d in daily:
-        d["anomaly"] = d["cost_usd"] > threshold
-        if d["anomaly"]:
-            anomalies.append(d)
-    return {"source": "azure_api" if _get_token() else "mock", "daily": daily, "mean_daily_usd": round(mean, 2), "std_dev_usd": round(std, 2), "anomaly_threshold_usd": round(threshold, 2), "anomaly_days": anomalies, "total_usd": round(sum(costs), 2)}
-
-def get_cost_by_resource_group(subscription_id=None):
+# Builds new rows rather than flagging the caller's dicts in place
+def _annotate_anomalies(daily, source="mock"):
+    if not daily:
+        return {"source": source, "daily": [], "mean_daily_usd": 0.0, "std_dev_usd": 0.0, "anomaly_threshold_usd": 0.0, "anomaly_days": [], "total_usd": 0.0}
+    costs = np.array([d["cost_usd"] for d in daily], dtype=np.float64)
+    days = np.array([d["date"] for d in daily], dtype="datetime64[D]")
+    scan = AnomalyEngine(["total"]).scan([d["date"] for d in daily], costs[None, :])
+    rows = []
+    for i, d in enumerate(daily):
+        row = dict(d, anomaly=bool(scan["flagged"][0, i]))
+        if row["anomaly"]:
+            row["expected_usd"] = round(float(scan["expected"][0, i]), 2)
+            row["score"] = round(float(scan["score"][0, i]), 1)
+        rows.append(row)
+    limit = scan["limit"][0, -1]
+    return {
+        "source": source, "daily": rows,
+        "mean_daily_usd": round(float(costs.mean()), 2), "std_dev_usd": round(float(costs.std()), 2),
+        "anomaly_threshold_usd": round(float(limit), 2) if np.isfinite(limit) else None,
+        "anomaly_days": [r for r in rows if r["anomaly"]], "total_usd": round(float(costs.sum()), 2),
+        "week_over_week": period_over_period(costs, 7), "month_end_forecast": forecast_month_end(days, costs),
+    }
+
+# Runs every resource group's daily series through one vectorised anomaly scan
+def get_resource_group_anomalies(subscription_id=None, from_date=None, to_date=None):
     sub_id = subscription_id or os.environ.get("AZURE_SUBSCRIPTION_ID", "")
     token = _get_token()
     if token and sub_id:
-        today = datetime.date.today()
-        from_date = (today - datetime.timedelta(days=30)).isoformat()
-        to_date = today.isoformat()
-        url = f"https://management.azure.com/subscriptions/{sub_id}/providers/Microsoft.CostManagement/query?api-version=2023-03-01"
-        body = {
-            "type": "ActualCost",
-            "timeframe": "Custom",
-            "timePeriod": {"from": from_date, "to": to_date},
-            "dataset": {"granularity": "None", "aggregation": {"totalCost": {"name": "Cost", "function": "Sum"}}, "grouping": [{"type": "Dimension", "name": "ResourceGroupName"}]},
+        from_date, to_date = _window(from_date=from_date, to_date=to_date)
+        table = _load_cost_table(subscription_scope(sub_id), token, from_date, to_date)
+        names, days, matrix = pivot_daily(table.resource_group, table.date, table.cost)
+        source = "azure_api"
+    else:
+        names, days, matrix = _mock_resource_group_daily(from_date, to_date)
+        from_date, to_date = days[0], days[-1]
+        source = "mock"
+    scan = AnomalyEngine(names).scan(days, matrix)
+    rg_idx, day_idx = np.nonzero(scan["flagged"])
+    spikes = [
+        {
+            "resource_group": names[r], "date": days[t], "cost_usd": round(float(matrix[r, t]), 2),
+            "expected_usd": round(float(scan["expected"][r, t]), 2), "score": round(float(scan["score"][r, t]), 1),
         }
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        resp = requests.post(url, json=body, headers=headers, timeout=20)
-        resp.raise_for_status()
-        raw = resp.json()
-        cols = [c["name"] for c in raw["properties"]["columns"]]
-        groups = []
-        for row in raw["properties"]["rows"]:
-            rec = dict(zip(cols, row))
-            groups.append({"resource_group": rec.get("ResourceGroupName", "Unknown"), "cost_usd": round(float(rec.get("Cost", 0)), 2)})
-        groups.sort(key=lambda x: x["cost_usd"], reverse=True)
-        return {"source": "azure_api", "period": f"{from_date} to {to_date}", "resource_groups": groups, "total_usd": round(sum(g["cost_usd"] for g in groups), 2)}
-    today = datetime.date.today()
+        for r, t in zip(rg_idx, day_idx)
+    ]
+    spikes.sort(key=lambda x: x["cost_usd"] - x["expected_usd"], reverse=True)
+    return {
+        "source": source, "period": f"{from_date} to {to_date}", "resource_groups_scanned": len(names),
+        "spike_count": len(spikes), "spikes": spikes,
+        "latest_day_spikes": [s for s in spikes if s["date"] == days[-1]] if days else [],
+    }
+
+# Daily job: restores the engine saved at state_path and fetches and scans only the
+# closed days since its last run, so neither the query nor the scan grows with the
+# history kept. Without saved state the last HISTORY_DAYS are loaded (from the local
+# warehouse when COST_WAREHOUSE=true) so the fresh engine has a baseline.
+def scan_resource_group_anomalies(subscription_id=None, state_path=STATE_PATH):
+    sub_id = subscription_id or os.environ.get("AZURE_SUBSCRIPTION_ID", "")
+    token = _get_token()
+    to_date = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    from_date = (datetime.date.fromisoformat(to_date) - datetime.timedelta(days=HISTORY_DAYS - 1)).isoformat()
+    last_date = saved_last_date(state_path)
+    if last_date:
+        from_date = max(from_date, (datetime.date.fromisoformat(last_date) + datetime.timedelta(days=1)).isoformat())
+    if from_date > to_date:
+        names, days, matrix = [], [], np.zeros((0, 0))
+        source = "azure_api" if token and sub_id else "mock"
+    elif token and sub_id:
+        table = _load_cost_table(subscription_scope(sub_id), token, from_date, to_date)
+        names, days, matrix = pivot_daily(table.resource_group, table.date, table.cost)
+        source = "azure_api"
+    else:
+        names, days, matrix = _mock_resource_group_daily(from_date, to_date)
+        source = "mock"
+    row = {name: i for i, name in enumerate(names)}
+    keys, scanned, scan = scan_incremental(state_path, names, days, matrix)
+    offset = len(days) - len(scanned)
+    rg_idx, day_idx = np.nonzero(scan["flagged"])
+    spikes = [
+        {
+            "resource_group": keys[r], "date": scanned[t],
+            "cost_usd": round(float(matrix[row[keys[r]], offset + t]), 2) if keys[r] in row else 0.0,
+            "expected_usd": round(float(scan["expected"][r, t]), 2), "score": round(float(scan["score"][r, t]), 1),
+        }
+        for r, t in zip(rg_idx, day_idx)
+    ]
+    spikes.sort(key=lambda x: x["cost_usd"] - x["expected_usd"], reverse=True)
+    return {"source": source, "resource_groups_scanned": len(keys), "days_scanned": scanned, "spike_count": len(spikes), "spikes": spikes}
+
+def _mock_resource_group_daily(from_date=None, to_date=None):
+    share = {"rg-production": 0.61, "rg-staging": 0.17, "rg-data-platform": 0.14, "rg-monitoring": 0.05, "rg-dev": 0.03}
+    daily = _mock_daily_trend(from_date, to_date)
+    rng = np.random.default_rng(7)
+    base = np.array([[d["cost_usd"] for d in daily]])
+    # The shared spikes hit production; data-platform gets one of its own
+    calm = np.array([[min(c, 150.0) for c in base[0]]])
+    matrix = np.vstack([
+        (base if name == "rg-production" else calm) * pct * rng.uniform(0.95, 1.05, base.shape[1])
+        for name, pct in share.items()
+    ])
+    spike_day = (datetime.date.today() - datetime.timedelta(days=5)).isoformat()
+    matrix[2, [d["date"] == spike_day for d in daily]] += 95.0
+    return list(share), [d["date"] for d in daily], np.round(matrix, 2)
+
+def get_cost_by_resource_group(subscription_id=None, from_date=None, to_date=None):
+    sub_id = subscription_id or os.environ.get("AZURE_SUBSCRIPTION_ID", "")
+    token = _get_token()
+    if token and sub_id:
+        from_date, to_date = _window(from_date=from_date, to_date=to_date)
+        table = _load_cost_table(subscription_scope(sub_id), token, from_date, to_date)
+        return _flag_truncated({"source": "azure_api", "period": f"{from_date} to {to_date}", **_scope_fields(sub_id, from_date, to_date), "resource_groups": table.by_resource_group(), "total_usd": table.total()}, table)
+    from_date, to_date, scale = _mock_window(from_date, to_date)
     groups = [
         {"resource_group": "rg-production", "cost_usd": 2180.40},
         {"resource_group": "rg-staging", "cost_usd": 620.15},
@@ -153,26 +435,47 @@ def get_cost_by_resource_group(subscription_id=None):
         {"resource_group": "rg-monitoring", "cost_usd": 175.60},
         {"resource_group": "rg-dev", "cost_usd": 113.70},
     ]
-    return {"source": "mock", "period": f"{(today - datetime.timedelta(days=30)).isoformat()} to {today.isoformat()}", "resource_groups": groups, "total_usd": round(sum(g["cost_usd"] for g in groups), 2)}
-
-def suggest_optimisations(cost_data):
-    services = {s["service"]: s["cost_usd"] for s in cost_data.get("services", [])}
-    total = cost_data.get("total_usd", 0)
-    tips = []
-    potential = 0.0
-    rules = [
-        ("Virtual Machines", 0.30, "Switch to Reserved Instances 1-year for stable VMs saves 30-40%"),
-        ("Azure Kubernetes Service", 0.20, "Enable Cluster Autoscaler and use Spot node pools saves 60-80%"),
-        ("Azure SQL Database", 0.25, "Use Azure Hybrid Benefit if you have SQL Server licenses saves 25%"),
-        ("Azure Blob Storage", 0.40, "Move infrequently accessed blobs to Cool or Archive tier saves 40-70%"),
-        ("Azure Monitor", 0.30, "Reduce log retention and filter noisy logs at source saves 20-40%"),
-        ("Azure App Service", 0.20, "Consolidate to fewer App Service Plans or use consumption based Functions"),
-        ("Azure Load Balancer", 0.15, "Review unused load balancer rules and remove unused ones"),
-    ]
-    for service, saving_pct, tip in rules:
-        if service in services and services[service] > 50:
-            saving = round(services[service] * saving_pct, 2)
-            tips.append({"service": service, "current_cost": services[service], "tip": tip, "est_saving_usd": saving})
-            potential += saving
+    groups = _scaled(groups, scale)
+    return {"source": "mock", "period": f"{from_date} to {to_date}", **_scope_fields(None, from_date, to_date), "resource_groups": _with_pct(groups), "total_usd": round(sum(g["cost_usd"] for g in groups), 2)}
+
+# cost_data either carries resource-level rows under "resources" (resource_id,
+# service, meter_category, resource_group, tags, cost_usd and optional utilisation
+# metrics) or the per-service totals of get_cost_by_service. For the latter, resource
+# rows are fetched with get_resource_costs for the subscription and window the totals
+# came from (its subscription_id/from_date/to_date fields, or the arguments given
+# here). Multi-scope totals carry neither, so their service totals are scored as-is.
+def suggest_optimisations(cost_data, subscription_id=None, from_date=None, to_date=None):
+    total     = cost_data.get("total_usd", 0)
+    resources = cost_data.get("resources")
+    from_date = from_date or cost_data.get("from_date")
+    to_date   = to_date or cost_data.get("to_date")
+    if resources is None and from_date and to_date:
+        sub_id    = subscription_id or cost_data.get("subscription_id")
+        resources = get_resource_costs(sub_id, from_date, to_date)["resources"] or None
+    if resources is None:
+        rows = [{"service": s["service"], "cost_usd": s["cost_usd"]} for s in cost_data.get("services", [])]
+        tips = [
+            {"service": row["service"], "current_cost": row["cost_usd"], "tip": rule["tip"], "est_saving_usd": round(saving, 2), "rule": rule["id"]}
+            for rule, row, _, saving in rule_index().evaluate(rows)
+        ]
+    else:
+        by_rule = {}
+        for rule, row, cost, saving in rule_index().evaluate(resources):
+            agg = by_rule.setdefault(rule["id"], {"rule": rule["id"], "tip": rule["tip"], "services": set(), "resources": 0, "current_cost": 0.0, "est_saving_usd": 0.0, "top": []})
+            agg["services"].add(row.get("service") or "Unknown")
+            agg["resources"] += 1
+            agg["current_cost"] += cost
+            agg["est_saving_usd"] += saving
+            agg["top"].append((saving, row.get("resource_id")))
+        tips = []
+        for agg in by_rule.values():
+            top = sorted(agg.pop("top"), key=lambda x: x[0], reverse=True)[:3]
+            agg.update(
+                services=sorted(agg["services"]), current_cost=round(agg["current_cost"], 2), est_saving_usd=round(agg["est_saving_usd"], 2),
+                top_resources=[{"resource_id": rid, "est_saving_usd": round(sv, 2)} for sv, rid in top],
+            )
+            tips.append(agg)
+        total = total or round(sum(float(r.get("cost_usd") or 0) for r in resources), 2)
     tips.sort(key=lambda x: x["est_saving_usd"], reverse=True)
+    potential = sum(t["est_saving_usd"] for t in tips)
     return {"total_spend_usd": total, "potential_savings_usd": round(potential, 2), "savings_pct_of_total": round(potential / total * 100, 1) if total else 0, "recommendations": tips}
@@ -0,0 +1,86 @@
+import hashlib
+import numpy as np
+from tools.analytics import CostFrame
+
+COLUMN_MAP = {"UsageDate": "date", "ServiceName": "service", "ResourceGroupName": "resource_group", "Cost": "cost"}
+
+
+def _iso_date(value):
+    text = str(value)
+    if len(text) == 8 and text.isdigit():
+        return f"{text[:4]}-{text[4:6]}-{text[6:]}"
+    return text[:10]
+
+
+# Columnar store for one Daily x ServiceName x ResourceGroupName query. Rows are
+# collected as lists (cheap to extend page by page and to cache as JSON); every view
+# the tools need is a vectorised group-by in tools.analytics.
+class CostTable:
+
+    COLUMNS = ("date", "service", "resource_group", "cost")
+
+    def __init__(self, date=None, service=None, resource_group=None, cost=None, truncated=False, digest=None):
+        self.date           = date if date is not None else []
+        self.service        = service if service is not None else []
+        self.resource_group = resource_group if resource_group is not None else []
+        self.cost           = cost if cost is not None else []
+        self.truncated      = truncated
+        self.digest         = digest
+        self._frame         = None
+        self._frame_rows    = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{c: data[c] for c in cls.COLUMNS}, truncated=data.get("truncated", False), digest=data.get("digest"))
+
+    @classmethod
+    def concat(cls, tables):
+        merged = cls()
+        for table in tables:
+            for c in cls.COLUMNS:
+                getattr(merged, c).extend(getattr(table, c))
+            merged.truncated = merged.truncated or table.truncated
+        return merged
+
+    def to_dict(self):
+        return dict({c: getattr(self, c) for c in self.COLUMNS}, truncated=self.truncated, digest=self.digest)
+
+    # Content hash, computed once when a table is fetched and cached alongside it
+    def compute_digest(self):
+        h = hashlib.sha256()
+        for column in ("date", "service", "resource_group"):
+            h.update("\x1f".join(getattr(self, column)).encode())
+            h.update(b"\x1e")
+        h.update(np.asarray(self.cost, dtype=np.float64).tobytes())
+        return h.hexdigest()[:16]
+
+    def extend(self, columns, rows):
+        idx = {COLUMN_MAP[c]: i for i, c in enumerate(columns) if c in COLUMN_MAP}
+        i_date, i_svc, i_rg, i_cost = (idx.get(c) for c in self.COLUMNS)
+        for row in rows:
+            self.date.append(_iso_date(row[i_date]) if i_date is not None else "")
+            self.service.append((row[i_svc] or "Unknown") if i_svc is not None else "Unknown")
+            self.resource_group.append((row[i_rg] or "Unknown") if i_rg is not None else "Unknown")
+            self.cost.append(float(row[i_cost] or 0) if i_cost is not None else 0.0)
+
+    def __len__(self):
+        return len(self.cost)
+
+    # Aggregations run on a NumPy view of the columns, rebuilt only after a change
+    def frame(self):
+        if self._frame is None or self._frame_rows != len(self.cost):
+            self._frame = CostFrame(self.date, self.service, self.resource_group, self.cost)
+            self._frame_rows = len(self.cost)
+        return self._frame
+
+    def total(self):
+        return round(self.frame().total(), 2)
+
+    def by_service(self):
+        return self.frame().by_service()
+
+    def by_resource_group(self):
+        return self.frame().by_resource_group()
+
+    def daily(self):
+        return self.frame().daily()
@@ -0,0 +1,126 @@
+import os, time, sqlite3, datetime, threading
+from pathlib import Path
+from tools.cost_table import CostTable
+
+ENABLED          = os.environ.get("COST_WAREHOUSE", "false").lower() == "true"
+WAREHOUSE_PATH   = os.environ.get("COST_WAREHOUSE_PATH", str(Path(__file__).parent.parent / "data" / "cost_warehouse.db"))
+RESTATEMENT_DAYS = int(os.environ.get("COST_WAREHOUSE_RESTATEMENT_DAYS", "3"))
+MIN_SYNC_SEC     = int(os.environ.get("COST_WAREHOUSE_MIN_SYNC_SEC", "900"))
+CHUNK_DAYS       = int(os.environ.get("COST_WAREHOUSE_CHUNK_DAYS", "90"))
+
+
+def _day(value):
+    return datetime.date.fromisoformat(value)
+
+
+def _ranges(from_date, to_date, chunk_days=CHUNK_DAYS):
+    start, end = _day(from_date), _day(to_date)
+    while start <= end:
+        stop = min(end, start + datetime.timedelta(days=chunk_days - 1))
+        yield start.isoformat(), stop.isoformat()
+        start = stop + datetime.timedelta(days=1)
+
+
+# Daily cost rows per scope, service and resource group in SQLite. Each scope keeps
+# the range it covers; a sync re-pulls only the days after the watermark plus the last
+# RESTATEMENT_DAYS (Azure restates recent usage), and a request older than the
+# covered range backfills just the missing days. Reads never call Azure.
+class CostWarehouse:
+
+    def __init__(self, path=WAREHOUSE_PATH, restatement_days=RESTATEMENT_DAYS, min_sync_sec=MIN_SYNC_SEC):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.restatement_days = restatement_days
+        self.min_sync_sec     = min_sync_sec
+        self._lock    = threading.Lock()
+        self._flights = {}
+        self._conn    = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cost_daily (scope TEXT, date TEXT, service TEXT, resource_group TEXT, cost REAL, "
+            "PRIMARY KEY (scope, date, service, resource_group))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sync_state (scope TEXT PRIMARY KEY, earliest TEXT, watermark TEXT, synced_at REAL)")
+        self._conn.commit()
+        self._stats = {"syncs": 0, "days_pulled": 0, "rows_written": 0, "reads": 0}
+
+    def _state(self, scope):
+        with self._lock:
+            row = self._conn.execute("SELECT earliest, watermark, synced_at FROM sync_state WHERE scope = ?", (scope,)).fetchone()
+        return row
+
+    def _replace(self, scope, from_date, to_date, table):
+        totals = {}
+        for key, cost in zip(zip(table.date, table.service, table.resource_group), table.cost):
+            totals[key] = totals.get(key, 0.0) + cost
+        with self._lock:
+            self._conn.execute("DELETE FROM cost_daily WHERE scope = ? AND date BETWEEN ? AND ?", (scope, from_date, to_date))
+            self._conn.executemany(
+                "INSERT INTO cost_daily VALUES (?, ?, ?, ?, ?)",
+                [(scope, d, svc, rg, cost) for (d, svc, rg), cost in totals.items()],
+            )
+            self._conn.commit()
+            self._stats["rows_written"] += len(totals)
+            self._stats["days_pulled"]  += (_day(to_date) - _day(from_date)).days + 1
+
+    def _pull(self, scope, fetch, from_date, to_date):
+        for start, stop in _ranges(from_date, to_date):
+            table = fetch(start, stop)
+            if table.truncated:
+                # Storing a partial range would mark its missing rows as synced
+                raise RuntimeError(f"Cost query for {scope} {start} to {stop} hit COST_QUERY_MAX_PAGES; lower COST_WAREHOUSE_CHUNK_DAYS")
+            self._replace(scope, start, stop, table)
+
+    # fetch(from_date, to_date) -> CostTable pulls one range from Cost Management
+    def ensure(self, scope, from_date, to_date, fetch):
+        with self._lock:
+            flight = self._flights.setdefault(scope, threading.Lock())
+        with flight:
+            today = datetime.date.today()
+            state = self._state(scope)
+            if state is None:
+                earliest, watermark, synced_at = from_date, None, 0.0
+                self._pull(scope, fetch, from_date, today.isoformat())
+            else:
+                earliest, watermark, synced_at = state
+                if from_date < earliest:
+                    self._pull(scope, fetch, from_date, (_day(earliest) - datetime.timedelta(days=1)).isoformat())
+                    earliest = from_date
+                    self._save_state(scope, earliest, watermark, synced_at)
+                if time.time() - synced_at < self.min_sync_sec and to_date <= watermark:
+                    return
+                start = max(_day(earliest), _day(watermark) - datetime.timedelta(days=self.restatement_days))
+                self._pull(scope, fetch, start.isoformat(), today.isoformat())
+            self._save_state(scope, earliest, today.isoformat(), time.time())
+            with self._lock:
+                self._stats["syncs"] += 1
+
+    def _save_state(self, scope, earliest, watermark, synced_at):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)", (scope, earliest, watermark, synced_at))
+            self._conn.commit()
+
+    # Changes on every sync of the scope, so it can stand in for a content hash
+    def version(self, scope):
+        state = self._state(scope)
+        return f"{state[1]}@{state[2]:.0f}" if state else "empty"
+
+    def load(self, scope, from_date, to_date):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, service, resource_group, cost FROM cost_daily WHERE scope = ? AND date BETWEEN ? AND ? ORDER BY date",
+                (scope, from_date, to_date),
+            ).fetchall()
+            self._stats["reads"] += 1
+        if not rows:
+            return CostTable()
+        return CostTable(*(list(col) for col in zip(*rows)))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["scopes"] = self._conn.execute("SELECT COUNT(*) FROM sync_state").fetchone()[0]
+            stats["rows"]   = self._conn.execute("SELECT COUNT(*) FROM cost_daily").fetchone()[0]
+        return stats
+
+
+WAREHOUSE = CostWarehouse() if ENABLED else None
@@ -0,0 +1,94 @@
+import os, time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tools.azure_cost import (
+    _get_token, _window, _load_cost_table, _annotate_anomalies,
+    subscription_scope, management_group_scope,
+    get_cost_by_service, get_daily_cost_trend, get_cost_by_resource_group,
+)
+from tools.cost_table import CostTable
+from tools.analytics import percent_of_total
+
+MAX_WORKERS = int(os.environ.get("COST_FANOUT_WORKERS", "8"))
+
+
+def _scopes(subscription_ids=None, management_group=None):
+    if management_group:
+        return {management_group: management_group_scope(management_group)}
+    if subscription_ids is None:
+        env_ids = os.environ.get("AZURE_SUBSCRIPTION_IDS", "") or os.environ.get("AZURE_SUBSCRIPTION_ID", "")
+        subscription_ids = [s.strip() for s in env_ids.split(",") if s.strip()]
+    return {sub_id: subscription_scope(sub_id) for sub_id in subscription_ids}
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _fan_out(scopes, max_workers, from_date=None, to_date=None):
+    token = _get_token()
+    if not token or not scopes:
+        return None
+    from_date, to_date = _window(from_date=from_date, to_date=to_date)
+    def fetch(name, scope):
+        t0 = time.perf_counter()
+        try:
+            table = _load_cost_table(scope, token, from_date, to_date)
+            return name, table, round((time.perf_counter() - t0) * 1000, 1), None
+        except Exception as e:
+            return name, None, round((time.perf_counter() - t0) * 1000, 1), str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(scopes)))) as pool:
+        outcomes = list(pool.map(lambda item: fetch(*item), scopes.items()))
+
+    tables = {name: table for name, table, _, err in outcomes if err is None}
+    if not tables:
+        raise RuntimeError(f"Cost query failed for all {len(scopes)} scopes: {outcomes[0][3]}")
+    latencies = [ms for _, _, ms, _ in outcomes]
+    stats = {
+        "scopes":         len(scopes),
+        "succeeded":      len(tables),
+        "failed":         len(scopes) - len(tables),
+        "p50_latency_ms": _percentile(latencies, 50),
+        "max_latency_ms": max(latencies) if latencies else 0.0,
+        "per_scope": {name: {"latency_ms": ms, "ok": err is None, "error": err} for name, _, ms, err in outcomes},
+        "truncated":      sorted(name for name, table in tables.items() if table.truncated),
+    }
+    return tables, stats, f"{from_date} to {to_date}"
+
+
+def get_cost_by_service_multi(subscription_ids=None, management_group=None, max_workers=MAX_WORKERS, from_date=None, to_date=None):
+    result = _fan_out(_scopes(subscription_ids, management_group), max_workers, from_date, to_date)
+    if result is None:
+        return dict(get_cost_by_service(from_date=from_date, to_date=to_date), fanout_stats=None)
+    tables, stats, period = result
+    merged   = CostTable.concat(tables.values())
+    services = merged.by_service()
+    return {"source": "azure_api", "period": period, "total_usd": merged.total(), "service_count": len(services), "services": services[:15], "fanout_stats": stats}
+
+
+def get_daily_cost_trend_multi(subscription_ids=None, management_group=None, max_workers=MAX_WORKERS, from_date=None, to_date=None):
+    result = _fan_out(_scopes(subscription_ids, management_group), max_workers, from_date, to_date)
+    if result is None:
+        return dict(get_daily_cost_trend(from_date=from_date, to_date=to_date), fanout_stats=None)
+    tables, stats, _ = result
+    out = _annotate_anomalies(CostTable.concat(tables.values()).daily(), source="azure_api")
+    out["fanout_stats"] = stats
+    return out
+
+
+def get_cost_by_resource_group_multi(subscription_ids=None, management_group=None, max_workers=MAX_WORKERS, from_date=None, to_date=None):
+    result = _fan_out(_scopes(subscription_ids, management_group), max_workers, from_date, to_date)
+    if result is None:
+        return dict(get_cost_by_resource_group(from_date=from_date, to_date=to_date), fanout_stats=None)
+    tables, stats, period = result
+    groups = []
+    for name, table in tables.items():
+        groups.extend(dict(g, scope=name) for g in table.by_resource_group())
+    groups.sort(key=lambda x: x["cost_usd"], reverse=True)
+    pct = percent_of_total(np.array([g["cost_usd"] for g in groups], dtype=np.float64))
+    groups = [dict(g, pct_of_total=round(float(p), 1)) for g, p in zip(groups, pct)]
+    return {"source": "azure_api", "period": period, "resource_groups": groups, "total_usd": round(sum(t.total() for t in tables.values()), 2), "fanout_stats": stats}
@@ -0,0 +1,112 @@
+import os, random, threading, time, datetime, requests
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "10"))
+POOL_MAXSIZE     = int(os.environ.get("HTTP_POOL_MAXSIZE", "20"))
+MAX_RETRIES      = int(os.environ.get("HTTP_MAX_RETRIES", "4"))
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC  = 60.0
+MAX_SERVER_WAIT  = float(os.environ.get("HTTP_MAX_SERVER_WAIT_SEC", "300"))
+RETRY_STATUS     = {429, 500, 502, 503, 504}
+
+_session      = None
+_session_lock = threading.Lock()
+_stats_lock   = threading.Lock()
+_stats        = {"requests": 0, "retries": 0, "throttled": 0}
+
+
+# One Session per process: urllib3 keeps a keep-alive pool per host (pool_connections
+# hosts, pool_maxsize sockets each), so repeated queries reuse the TLS connection.
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+                _session = session
+    return _session
+
+
+def _parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return (when - datetime.datetime.now(when.tzinfo)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+# Cost Management reports throttling through Retry-After and a family of
+# x-ms-ratelimit-microsoft.costmanagement-*-retry-after headers (qpu, entity, tenant,
+# clienttype); the longest one wins.
+def _server_delay(resp):
+    delays = []
+    for name, value in resp.headers.items():
+        name = name.lower()
+        if name == "retry-after" or (name.startswith("x-ms-ratelimit-") and name.endswith("retry-after")):
+            delay = _parse_retry_after(value)
+            if delay is not None:
+                delays.append(delay)
+    return max(delays) if delays else None
+
+
+# A server-requested delay is honoured in full (BACKOFF_MAX_SEC only caps our own
+# exponential backoff); retrying sooner would just spend attempts on more 429s.
+def _backoff_delay(attempt, resp=None):
+    server = _server_delay(resp) if resp is not None else None
+    if server is not None:
+        return max(server, 0.0) + random.uniform(0, BACKOFF_BASE_SEC)
+    return random.uniform(0, min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** attempt))
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+# before_send runs ahead of every attempt, so a rate limiter passed in also covers
+# retries, not just the first send
+def request(method, url, timeout=20, max_retries=MAX_RETRIES, before_send=None, **kwargs):
+    session = get_session()
+    for attempt in range(max_retries + 1):
+        if before_send is not None:
+            before_send()
+        _count("requests")
+        try:
+            resp = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+            _count("retries")
+            time.sleep(_backoff_delay(attempt))
+            continue
+        if resp.status_code in RETRY_STATUS and attempt < max_retries:
+            if resp.status_code == 429:
+                _count("throttled")
+            delay = _backoff_delay(attempt, resp)
+            if delay > MAX_SERVER_WAIT:
+                # Longer than we are willing to block: surface the 429 to the caller
+                resp.raise_for_status()
+            _count("retries")
+            resp.close()
+            time.sleep(delay)
+            continue
+        resp.raise_for_status()
+        return resp
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def http_stats():
+    with _stats_lock:
+        return dict(_stats)
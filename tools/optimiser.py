@@ -0,0 +1,131 @@
+import os, json
+from pathlib import Path
+
+RULES_PATH = os.environ.get("OPTIMISATION_RULES_PATH", str(Path(__file__).parent / "optimisation_rules.json"))
+
+
+def _norm(value):
+    return str(value).strip().lower()
+
+
+# Savings models take the cost still unclaimed on a resource and return the saving
+def _flat(model, cost, row):
+    return cost * model["pct"]
+
+
+# Marginal rates: tiers [[from_usd, pct], ...] apply pct to the slice of cost above from_usd
+def _tiered(model, cost, row):
+    tiers  = sorted(model["tiers"])
+    saving = 0.0
+    for i, (start, pct) in enumerate(tiers):
+        stop = tiers[i + 1][0] if i + 1 < len(tiers) else float("inf")
+        if cost > start:
+            saving += (min(cost, stop) - start) * pct
+    return saving
+
+
+# Rows without the metric are skipped; below target the idle share is claimable
+def _utilisation(model, cost, row):
+    used = row.get(model["metric"])
+    if used is None or used >= model["target"]:
+        return 0.0
+    return cost * min(model["max_pct"], 1 - used / model["target"])
+
+
+MODELS = {"flat": _flat, "tiered": _tiered, "utilisation": _utilisation}
+
+
+# Rules are compiled into an inverted index of (field, value) -> rule positions, so a
+# resource only tests the rules that mention its service, meter category or a tag it
+# carries. Within a rule each field must match when the row carries it (fields a row
+# does not have, e.g. meter_category on service totals, are not checked).
+class RuleIndex:
+
+    def __init__(self, rules):
+        self.rules = []
+        self.index = {}
+        for pos, rule in enumerate(rules):
+            if rule["model"]["type"] not in MODELS:
+                raise ValueError(f"Unknown savings model '{rule['model']['type']}' in rule {rule['id']}")
+            match = rule.get("match", {})
+            compiled = {
+                "service":        {_norm(v) for v in match.get("service", [])},
+                "meter_category": {_norm(v) for v in match.get("meter_category", [])},
+                "tags":           {_norm(k): {_norm(v) for v in vs} for k, vs in match.get("tags", {}).items()},
+            }
+            self.rules.append(dict(rule, priority=rule.get("priority", pos), compiled=compiled))
+            for field in ("service", "meter_category"):
+                for value in compiled[field]:
+                    self.index.setdefault((field, value), []).append(pos)
+            for key, values in compiled["tags"].items():
+                for value in values:
+                    self.index.setdefault(("tag", key, value), []).append(pos)
+
+    @classmethod
+    def load(cls, path=RULES_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["rules"])
+
+    @staticmethod
+    def _keys(row):
+        return {
+            "service":        _norm(row["service"]) if row.get("service") else None,
+            "meter_category": _norm(row["meter_category"]) if row.get("meter_category") else None,
+            "tags":           {_norm(k): _norm(v) for k, v in (row.get("tags") or {}).items()},
+        }
+
+    def candidates(self, keys):
+        hits = set()
+        for field in ("service", "meter_category"):
+            if keys[field]:
+                hits.update(self.index.get((field, keys[field]), ()))
+        for key, value in keys["tags"].items():
+            hits.update(self.index.get(("tag", key, value), ()))
+        return sorted(hits, key=lambda pos: self.rules[pos]["priority"])
+
+    def matches(self, rule, keys):
+        c = rule["compiled"]
+        for field in ("service", "meter_category"):
+            if c[field] and keys[field] and keys[field] not in c[field]:
+                return False
+        if c["tags"] and not any(keys["tags"].get(k) in vs for k, vs in c["tags"].items()):
+            return False
+        return True
+
+    # One pass over rows: each row's matching rules are applied in priority order to
+    # the cost not already claimed, keeping only the best rule per exclusive group, so
+    # overlapping rules never promise more than the resource costs.
+    def evaluate(self, rows):
+        findings = []
+        for row in rows:
+            cost = float(row.get("cost_usd") or 0)
+            if cost <= 0:
+                continue
+            keys = self._keys(row)
+            best = {}
+            for pos in self.candidates(keys):
+                rule = self.rules[pos]
+                if cost < rule.get("min_cost", 0) or not self.matches(rule, keys):
+                    continue
+                saving = MODELS[rule["model"]["type"]](rule["model"], cost, row)
+                group = rule.get("group", rule["id"])
+                if saving > 0 and (group not in best or saving > best[group][1]):
+                    best[group] = (rule, saving)
+            remaining = cost
+            for rule, _ in sorted(best.values(), key=lambda rs: rs[0]["priority"]):
+                saving = min(remaining, MODELS[rule["model"]["type"]](rule["model"], remaining, row))
+                if saving <= 0:
+                    continue
+                remaining -= saving
+                findings.append((rule, row, cost, saving))
+        return findings
+
+
+_RULES = None
+
+
+def rule_index():
+    global _RULES
+    if _RULES is None:
+        _RULES = RuleIndex.load()
+    return _RULES
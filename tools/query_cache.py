@@ -0,0 +1,108 @@
+import os, json, time, datetime, sqlite3, threading
+from collections import OrderedDict
+
+MAX_ENTRIES    = int(os.environ.get("COST_CACHE_MAX_ENTRIES", "256"))
+TTL_OPEN_SEC   = int(os.environ.get("COST_CACHE_TTL_OPEN_SEC", "900"))
+TTL_CLOSED_SEC = int(os.environ.get("COST_CACHE_TTL_CLOSED_SEC", "86400"))
+CACHE_PATH     = os.environ.get("COST_CACHE_PATH", "")
+
+
+class _DiskBackend:
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS query_cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL, stored_at REAL)")
+        self._conn.execute("DELETE FROM query_cache WHERE expires_at < ?", (time.time(),))
+        self._conn.commit()
+
+    def get(self, key):
+        row = self._conn.execute("SELECT value, expires_at FROM query_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, value, expires_at, max_entries):
+        now = time.time()
+        self._conn.execute("INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?)", (key, json.dumps(value), expires_at, now))
+        self._conn.execute(
+            "DELETE FROM query_cache WHERE expires_at < ? OR key NOT IN (SELECT key FROM query_cache ORDER BY stored_at DESC LIMIT ?)",
+            (now, max_entries),
+        )
+        self._conn.commit()
+
+    def clear(self):
+        self._conn.execute("DELETE FROM query_cache")
+        self._conn.commit()
+
+
+# Size-bounded LRU with per-entry expiry. Windows that include today hold a partial
+# day and expire after TTL_OPEN_SEC; closed windows keep for TTL_CLOSED_SEC.
+class QueryCache:
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl_open=TTL_OPEN_SEC, ttl_closed=TTL_CLOSED_SEC, path=CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl_open    = ttl_open
+        self.ttl_closed  = ttl_closed
+        self._lock       = threading.Lock()
+        self._entries    = OrderedDict()
+        self._disk       = _DiskBackend(path) if path else None
+        self._stats      = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(subscription_id, grouping, granularity, from_date, to_date):
+        return json.dumps([subscription_id, list(grouping), granularity, from_date, to_date])
+
+    def ttl_for(self, to_date):
+        if datetime.date.fromisoformat(to_date) >= datetime.date.today():
+            return self.ttl_open
+        return self.ttl_closed
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now < entry[1]:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[0]
+                del self._entries[key]
+            if self._disk is not None:
+                stored = self._disk.get(key)
+                if stored is not None and now < stored[1]:
+                    self._insert(key, stored[0], stored[1])
+                    self._stats["disk_hits"] += 1
+                    return stored[0]
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, value, ttl):
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._insert(key, value, expires_at)
+            if self._disk is not None:
+                self._disk.put(key, value, expires_at, self.max_entries)
+
+    def _insert(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+QUERY_CACHE = QueryCache()
@@ -0,0 +1,41 @@
+import os, time, threading
+
+RATE_PER_SEC = float(os.environ.get("COST_FANOUT_RATE_PER_SEC", "4"))
+BURST        = int(os.environ.get("COST_FANOUT_BURST", "8"))
+
+
+# Token bucket shared by every Cost Management request against the same tenant (each
+# page and each retry takes a token), so parallel fan-out workers stay under the
+# per-tenant query quota instead of tripping 429s.
+class RateLimiter:
+
+    def __init__(self, rate_per_sec=RATE_PER_SEC, burst=BURST):
+        self.rate     = rate_per_sec
+        self.capacity = burst
+        self._tokens  = float(burst)
+        self._stamp   = time.monotonic()
+        self._lock    = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp  = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_limiters     = {}
+_limiter_lock = threading.Lock()
+
+
+def tenant_limiter():
+    tenant_id = os.environ.get("AZURE_TENANT_ID", "")
+    with _limiter_lock:
+        if tenant_id not in _limiters:
+            _limiters[tenant_id] = RateLimiter()
+        return _limiters[tenant_id]